@@ -1133,7 +1133,7 @@ comp_syn = dict(
 
         compallow_L23PyrFRB_varInit_to_L5TuftedPyrIB = [39,40,41,42,43,44,45,46],
 
-        compallow_L23PyrFRB_varInit_to_L5TuftedPyrRS = [0.1, 39,40,41,42,43,44,45,46],
+        compallow_L23PyrFRB_varInit_to_L5TuftedPyrRS = [39,40,41,42,43,44,45,46],
 
         compallow_L23PyrFRB_varInit_to_DeepBasket = [5,6,7,8,9,10,18,19,20,21,22,23,31,32,33,34,35,36,
             44,45,46,47,48,49],
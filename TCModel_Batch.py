@@ -0,0 +1,505 @@
+'''
+    TCModel_Batch.py runs the batch of simulations described by BatchConfigs (TCModel_Config.py)
+    on a local pool of processes.
+
+    Every run is a separate process (python TCModel_Batch.py --run <run dir>) so a crashed run
+    only fails itself. Runs are saved in path2data/<batchLabel>/<run label>/ and the state of
+    every run is kept in path2data/<batchLabel>/manifest.json, which is also used to skip runs
+    already done when a batch is restarted. Failed runs are retried up to maxRetries times.
+
+    For sweeps not changing the network structure (stimulus parameters, synaptic strengths,
+    duration, noise seeds) the network can instead be built once and every run forked from the
+    built model (runBatchForked(), BatchConfigs.forkBatch), sharing its memory copy-on-write.
+
+    Usage:
+        python TCModel_Batch.py         # batch of SimulationConfigs (see BatchConfigs)
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+from collections import OrderedDict as ODict
+import json
+import multiprocessing
+import os
+from os.path import abspath, dirname, exists, join
+import subprocess
+import signal
+import sys
+import time
+import traceback
+import TCModel_Cache
+from TCModel_State import stateBuildOptions
+
+
+# Batch params that runBatchForked() can apply to an already built network (plus
+# ('stimSourceParams', <source>, <param>), ('synMechParams', <label>, 'g'/'weight'/<PARAMETER of its mod>) and
+# ('connParams', <label>, 'weight'/'delay') paths)
+forkParams = ['duration', 'dt']
+
+# Build options of SimulationConfigs given to every run (run.json) along with its simConfigDict
+runOptions = stateBuildOptions + ['equilibration', 'useStateCache', 'streamTraces', 'traceFlushInterval',
+                                  'saveSpikes', 'saveStores', 'filename']
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def availableMemory():
+    ''' Return memory available for new processes (bytes) or None if unknown (Linux only) '''
+    try:
+        with open('/proc/meminfo') as fileObj:
+            for line in fileObj:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except IOError:
+        pass
+
+    return None
+
+
+def poolSize(batchConfigs, memPerRun=None):
+    ''' Return number of concurrent runs: limited by cores (nthreads per run) and memory (memPerRun, GB) '''
+    if batchConfigs.numWorkers is not None:
+        return batchConfigs.numWorkers
+
+    if memPerRun is None:
+        memPerRun = batchConfigs.memPerRun
+
+    nthreads = getattr(batchConfigs, 'nthreads', 1)
+    numWorkers = max(1, multiprocessing.cpu_count()//nthreads)
+
+    memory = availableMemory()
+    if memory is not None:
+        numWorkers = min(numWorkers, max(1, int(memory//(memPerRun*2**30))))
+
+    return numWorkers
+
+
+def encodeLabel(label):
+    ''' Return JSON compatible batch param label (tuple paths become lists) '''
+    return list(label) if isinstance(label, tuple) else label
+
+
+def decodeLabel(label):
+    ''' Inverse of encodeLabel() '''
+    return tuple(str(key) for key in label) if isinstance(label, list) else str(label)
+
+
+def decodeValue(value):
+    ''' Return value read from JSON with unicode strings (also nested) as str '''
+    if isinstance(value, unicode):
+        return str(value)
+    if isinstance(value, list):
+        return [decodeValue(item) for item in value]
+    if isinstance(value, dict):
+        return dict((str(key), decodeValue(item)) for key, item in value.items())
+    return value
+
+
+def runConfigs(batchConfigs):
+    ''' Return (simConfigDict, build options) of the runs of batchConfigs (a SimulationConfigs)
+
+        Attributes of batchConfigs override its simConfigDict (e.g., duration set after construction).
+    '''
+    simConfigDict = dict((key, getattr(batchConfigs, key, value)) for key, value in batchConfigs.simConfigDict.items())
+    options = dict((name, getattr(batchConfigs, name)) for name in runOptions if hasattr(batchConfigs, name))
+
+    return simConfigDict, options
+
+
+def batchRuns(batchConfigs):
+    ''' Return ordered dictionary of run label -> run specification (params, replicate, configs)
+
+        Specifications are as read back from JSON (tuples become lists) to compare with the manifest.
+    '''
+    simConfigDict, options = runConfigs(batchConfigs)
+
+    runs = ODict()
+    for i, runParams in enumerate(batchConfigs.batchRunList()):
+        for replicate in range(batchConfigs.num_sims):
+            label = 'run_%04d' % i + ('_%d' % replicate if batchConfigs.num_sims > 1 else '')
+            runs[label] = json.loads(json.dumps({'params' : [[encodeLabel(key), value] for key, value in sorted(runParams.items())],
+                                                 'replicate' : replicate,
+                                                 'testing' : batchConfigs.testing,
+                                                 'simConfig' : simConfigDict,
+                                                 'options' : options}))
+
+    return runs
+
+
+def loadManifest(fileName):
+    ''' Return manifest (ordered dictionaries) or None if there is none '''
+    if not exists(fileName):
+        return None
+
+    with open(fileName) as fileObj:
+        return json.load(fileObj, object_pairs_hook=ODict)
+
+
+def saveManifest(manifest, fileName):
+    ''' Write manifest atomically (readable while the batch runs) '''
+    tmpName = fileName + '.%d.tmp' % os.getpid()
+    with open(tmpName, 'w') as fileObj:
+        json.dump(manifest, fileObj, indent=2)
+    os.rename(tmpName, fileName)
+
+
+def writeRunSpec(runDir, spec):
+    ''' Create run directory with its specification (run.json), removing results of earlier attempts '''
+    if not exists(runDir):
+        os.makedirs(runDir)
+    elif exists(join(runDir, 'result.json')):
+        os.remove(join(runDir, 'result.json'))
+
+    with open(join(runDir, 'run.json'), 'w') as fileObj:
+        json.dump(spec, fileObj, indent=2)
+
+
+def startRun(runDir, spec):
+    ''' Start process of one run, with output to runDir/log.txt '''
+    writeRunSpec(runDir, spec)
+
+    logFile = open(join(runDir, 'log.txt'), 'w')
+    process = subprocess.Popen([sys.executable, abspath(__file__), '--run', abspath(runDir)],
+                               cwd=dirname(abspath(__file__)), stdout=logFile, stderr=subprocess.STDOUT)
+    logFile.close()
+
+    return process
+
+
+def finishRun(entry, runDir, returncode):
+    ''' Update manifest entry of a finished process (returncode None: killed after timeout) '''
+    resultFile = join(runDir, 'result.json')
+    if returncode == 0 and exists(resultFile):
+        with open(resultFile) as fileObj:
+            entry['result'] = json.load(fileObj)
+        entry['status'] = 'done'
+        entry['error'] = None
+        return
+
+    entry['status'] = 'failed'
+    if returncode is None:
+        entry['error'] = 'timeout'
+    else:
+        with open(join(runDir, 'log.txt')) as fileObj:
+            entry['error'] = 'exit code %d: %s' % (returncode, ''.join(fileObj.readlines()[-5:]).strip())
+
+
+def scheduleRuns(batchConfigs, startFunc, numWorkers, pollInterval=1.):
+    ''' Run every run of the batch not done yet with at most numWorkers at a time and return the manifest
+
+        startFunc(runDir, spec) starts a run and returns an object with poll(), kill() and wait()
+        as subprocess.Popen (see startRun() and forkRun()).
+    '''
+    batchDir = join(batchConfigs.path2data, batchConfigs.batchLabel)
+    manifestFile = join(batchDir, 'manifest.json')
+    if not exists(batchDir):
+        os.makedirs(batchDir)
+
+    # Keep entries of an earlier (interrupted) execution of the same batch
+    runs = batchRuns(batchConfigs)
+    manifest = loadManifest(manifestFile) or ODict([('batchLabel', batchConfigs.batchLabel), ('runs', ODict())])
+    for label, spec in runs.items():
+        entry = manifest['runs'].get(label)
+        if entry is None or entry['spec'] != spec:
+            manifest['runs'][label] = ODict([('spec', spec), ('status', 'pending'), ('attempts', 0),
+                                             ('dir', join(batchDir, label)), ('result', None), ('error', None)])
+    saveManifest(manifest, manifestFile)
+
+    queue = [label for label in runs if manifest['runs'][label]['status'] != 'done']
+    print 'Batch %s: %d runs (%d done), %d workers' % (batchConfigs.batchLabel, len(runs), len(runs) - len(queue), numWorkers)
+
+    running = {}
+    while queue or running:
+
+        # Start runs while workers are free
+        while queue and len(running) < numWorkers:
+            label = queue.pop(0)
+            entry = manifest['runs'][label]
+            entry['status'] = 'running'
+            entry['attempts'] += 1
+            running[label] = (startFunc(entry['dir'], entry['spec']), time.time())
+        saveManifest(manifest, manifestFile)
+
+        time.sleep(pollInterval)
+
+        # Collect finished (or timed out) runs
+        for label, (process, start) in running.items():
+            returncode = process.poll()
+            if returncode is None:
+                if batchConfigs.runTimeout is None or time.time() - start < batchConfigs.runTimeout:
+                    continue
+                process.kill()
+                process.wait()
+
+            entry = manifest['runs'][label]
+            finishRun(entry, entry['dir'], returncode)
+            entry['wallTime'] = time.time() - start
+            del running[label]
+
+            if entry['status'] == 'failed' and entry['attempts'] <= batchConfigs.maxRetries:
+                queue.append(label)
+            print '  %s: %s (attempt %d, %.1f s)' % (label, entry['status'], entry['attempts'], entry['wallTime'])
+
+        saveManifest(manifest, manifestFile)
+
+    failed = [label for label in runs if manifest['runs'][label]['status'] != 'done']
+    print 'Batch %s finished: %d done, %d failed %s' % (batchConfigs.batchLabel, len(runs) - len(failed), len(failed), failed)
+
+    return manifest
+
+
+def runBatch(batchConfigs, pollInterval=1.):
+    ''' Run every run of the batch not done yet (see BatchConfigs), each in a new process '''
+    return scheduleRuns(batchConfigs, startRun, poolSize(batchConfigs), pollInterval)
+
+
+def applyRunParams(runParams, simConfig, simConfigs, netParams):
+    ''' Set every batch param (label -> value) on simConfig, simConfigs (build options) or netParams '''
+    for label, value in runParams.items():
+        if isinstance(label, tuple):
+            target = netParams
+            for key in label[:-1]:
+                target = target[key] if isinstance(target, dict) else getattr(target, key)
+            if isinstance(target, dict):
+                target[label[-1]] = value
+            else:
+                setattr(target, label[-1], value)
+        elif hasattr(simConfig, label):
+            setattr(simConfig, label, value)
+        elif hasattr(simConfigs, label):
+            setattr(simConfigs, label, value)
+        else:
+            raise Exception, 'UNKNOWN BATCH PARAM: ' + str(label)
+
+
+def runSimulation(runDir):
+    ''' Build, run and save one run of a batch as specified in runDir/run.json (in this process)
+
+        The run uses the simConfigDict and build options of the batch's SimulationConfigs saved
+        in its specification (see batchRuns()), with its batch params applied on top.
+    '''
+    from netpyne import specs, sim
+    from TCModel_Config import ModelConfigs
+    from TCModel_Run import buildNetParams, addStimulation, createNetwork, runNetwork
+    from TCModel_State import stateCacheKey
+
+    with open(join(runDir, 'run.json')) as fileObj:
+        spec = json.load(fileObj)
+    runParams = dict((decodeLabel(label), decodeValue(value)) for label, value in spec['params'])
+
+    fullConfigs = ModelConfigs(testing=spec['testing'])
+    simConfigs = fullConfigs.simConfigs
+    for name, value in decodeValue(spec['options']).items():
+        setattr(simConfigs, name, value)
+
+    netParams = addStimulation(buildNetParams(fullConfigs.params))
+    simConfig = specs.SimConfig(simConfigDict=decodeValue(spec['simConfig']))
+    applyRunParams(runParams, simConfig, simConfigs, netParams)
+
+    # Replicates differ by their random seeds only
+    simConfig.seeds = dict((key, value + spec['replicate']) for key, value in simConfig.seeds.items())
+
+    redirectOutput(simConfig, runDir, simConfigs.filename)
+
+    stateKey = None
+    if simConfigs.useStateCache:
+        stateKey = stateCacheKey(netParams, simConfig, simConfigs)
+
+    start = time.time()
+    createNetwork(netParams, simConfig, simConfigs)
+    t_build = time.time() - start
+
+    start = time.time()
+    runNetwork(simConfigs, stateKey)
+    t_run = time.time() - start
+
+    sim.analyze()
+    saveResult(runDir, t_build, t_run)
+
+
+def redirectOutput(simConfig, runDir, filename):
+    ''' Save output and figures of a run in its own directory '''
+    simConfig.saveFolder = runDir
+    simConfig.filename = join(runDir, filename)
+    for analysis in simConfig.analysis.values():
+        if isinstance(analysis, dict) and isinstance(analysis.get('saveFig'), basestring):
+            analysis['saveFig'] = join(runDir, os.path.basename(analysis['saveFig']))
+
+
+def saveResult(runDir, t_build, t_run):
+    ''' Write summary of a finished run (runDir/result.json), marking it as done '''
+    from netpyne import sim
+
+    if sim.rank == 0:
+        numCells = len(sim.net.allCells)
+        numSpikes = len(sim.allSimData['spkt'])
+        with open(join(runDir, 'result.json'), 'w') as fileObj:
+            json.dump({'numCells' : numCells,
+                       'numSpikes' : numSpikes,
+                       'rate' : numSpikes/float(numCells)/(sim.cfg.duration*1e-3) if numCells else 0.,     # mean rate (Hz)
+                       'build' : t_build,
+                       'run' : t_run}, fileObj, indent=2)
+
+
+class ForkedRun(object):
+    def __init__(self, pid):
+        ''' Forked run process with the subprocess.Popen methods used by scheduleRuns() '''
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid == self.pid:
+                self.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        return self.returncode
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+    def wait(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, 0)
+            self.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        return self.returncode
+
+
+def applyForkedParams(runParams, replicate):
+    ''' Apply batch params (see forkParams) and replicate seeds to the built network of this process '''
+    from netpyne import sim
+    import TCModel_Inputs
+    from TCModel_Network import updateSynapses
+
+    synapseChanges = {}
+    for label, value in runParams.items():
+        if isinstance(label, tuple) and len(label) == 3 and label[0] in ['synMechParams', 'connParams']:
+            synapseChanges.setdefault(label[1], {})[label[2]] = value
+        elif isinstance(label, tuple) and len(label) == 3 and label[0] == 'stimSourceParams':
+            sim.net.params.stimSourceParams[label[1]][label[2]] = value
+            for cell in sim.net.cells:
+                for stim in cell.stims:
+                    if stim.get('source') == label[1]:
+                        setattr(stim['hNetStim'] if 'hNetStim' in stim else stim['hObj'], label[2], value)
+                        stim[label[2]] = value
+        elif label in forkParams:
+            setattr(sim.cfg, label, value)
+        else:
+            raise Exception, 'BATCH PARAM NOT APPLICABLE TO BUILT NETWORK (use runBatch()): ' + str(label)
+
+    if synapseChanges:
+        updateSynapses(synapseChanges, reinit=False)
+
+    # Replicates differ by the noise streams of their NetStims
+    if replicate:
+        for cell in sim.net.cells:
+            for i, stim in enumerate(cell.stims):
+                if 'hRandom' in stim:
+                    stim['hRandom'].Random123(cell.gid, i, sim.cfg.seeds['stim'] + replicate)
+                    stim['hRandom'].negexp(1)
+
+    # Ectopic events for the run's source rates, duration and replicate
+    if TCModel_Inputs._ectopicInputs:
+        TCModel_Inputs.updateEctopicInput(sim.net.params, sim.cfg.duration, sim.cfg.seeds['stim'] + replicate)
+
+
+def forkRun(runDir, spec, simConfigs, t_build=0., stateKey=None):
+    ''' Fork this process (with the built network of simConfigs) to apply the run's params and run it
+
+        If stateKey (of the built network) is given, the run starts from the equilibrated state
+        of the network with the run's params (see TCModel_State).
+    '''
+    from netpyne import sim
+    from TCModel_Run import runNetwork
+
+    writeRunSpec(runDir, spec)
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid:
+        return ForkedRun(pid)
+
+    # Child: output to runDir/log.txt, never return into the parent's scheduler
+    code = 1
+    try:
+        logFd = os.open(join(runDir, 'log.txt'), os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        os.dup2(logFd, 1)
+        os.dup2(logFd, 2)
+
+        runParams = dict((decodeLabel(label), value) for label, value in spec['params'])
+        applyForkedParams(runParams, spec['replicate'])
+        redirectOutput(sim.cfg, runDir, os.path.basename(sim.cfg.filename))
+        if stateKey is not None:
+            stateKey = TCModel_Cache.hashObject([stateKey, spec['params'], spec['replicate']]).hexdigest()
+
+        start = time.time()
+        runNetwork(simConfigs, stateKey)
+        t_run = time.time() - start
+
+        sim.analyze()
+        saveResult(runDir, t_build, t_run)
+        code = 0
+    except:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def runBatchForked(batchConfigs, pollInterval=1.):
+    ''' Build the network once and run every run of the batch not done yet in a fork of this process
+
+        batchConfigs must be a SimulationConfigs: the network is built from its params, simConfigDict
+        (see runConfigs()) and build options. Only params in forkParams (and stimulus source and
+        synaptic params) can vary over the batch. Workers share the built model copy-on-write so
+        are sized by memPerFork.
+    '''
+    from netpyne import specs
+    from TCModel_Config import SimulationConfigs
+    from TCModel_Run import buildNetParams, addStimulation, createNetwork
+    from TCModel_State import stateCacheKey
+
+    if not isinstance(batchConfigs, SimulationConfigs):
+        raise Exception, 'FORKED BATCHES REQUIRE SimulationConfigs (simConfigDict and build options of the network)'
+
+    # NEURON's worker threads would not exist in the forked processes
+    if batchConfigs.nthreads > 1:
+        raise Exception, 'FORKED BATCHES REQUIRE nthreads = 1'
+
+    netParams = addStimulation(buildNetParams(batchConfigs.params))
+    simConfig = specs.SimConfig(simConfigDict=runConfigs(batchConfigs)[0])
+    stateKey = stateCacheKey(netParams, simConfig, batchConfigs) if batchConfigs.useStateCache else None
+
+    start = time.time()
+    createNetwork(netParams, simConfig, batchConfigs)
+    t_build = time.time() - start
+    print 'Network built once in %.1f s' % t_build
+
+    return scheduleRuns(batchConfigs,
+                        lambda runDir, spec: forkRun(runDir, spec, batchConfigs, t_build, stateKey),
+                        poolSize(batchConfigs, batchConfigs.memPerFork), pollInterval)
+
+
+
+
+################################################################################
+##### MAIN BATCH
+################################################################################
+if __name__ == '__main__':
+
+    if len(sys.argv) > 2 and sys.argv[1] == '--run':
+        runSimulation(sys.argv[2])
+        sys.exit(0)
+
+    from TCModel_Config import ModelConfigs
+
+    # Batch specification of the simulation configurations (see BatchConfigs)
+    batchConfigs = ModelConfigs().simConfigs
+    if batchConfigs.forkBatch:
+        runBatchForked(batchConfigs)
+    else:
+        runBatch(batchConfigs)
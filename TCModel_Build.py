@@ -0,0 +1,186 @@
+'''
+    TCModel_Build.py compiles and loads the NEURON mechanisms needed by TCModel_Run.py.
+    Only mechanisms referenced by the cell templates and synaptic mechanism parameters are
+    compiled, only .mod files whose contents changed are recompiled and the resulting
+    library is cached under TCModel_Cache.path2cache.
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import fcntl
+from glob import glob
+import hashlib
+import json
+import multiprocessing
+import os
+from os.path import join, exists, basename
+import re
+import shutil
+import subprocess
+import TCModel_Cache
+
+
+# Important paths for simulations
+path2mod = 'mod/generatedNEURON'
+
+# Build directory of mechanisms already loaded into this process (NEURON can't unload them)
+_loadedMechDir = None
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def stripModComments(text):
+    ''' Remove COMMENT blocks and ':' / '?' line comments from NMODL source '''
+    text = re.sub(r'(?s)\bCOMMENT\b.*?\bENDCOMMENT\b', '', text)
+    text = re.sub(r'[:?].*', '', text)
+
+    return text
+
+
+def modMechanismNames(modFile):
+    ''' Return mechanism names (SUFFIX, POINT_PROCESS or ARTIFICIAL_CELL) defined in a .mod file '''
+    with open(modFile) as f:
+        text = stripModComments(f.read())
+
+    return re.findall(r'\b(?:SUFFIX|POINT_PROCESS|ARTIFICIAL_CELL)\s+(\w+)', text)
+
+
+def templateMechanismNames(hocFile):
+    ''' Return names inserted (density mechanisms) or instantiated (point processes) in a hoc file '''
+    with open(hocFile) as f:
+        text = re.sub(r'//.*', '', f.read())
+
+    return set(re.findall(r'\binsert\s+(\w+)', text)) | set(re.findall(r'\bnew\s+(\w+)\s*\(', text))
+
+
+def requiredMechanisms(fullParams):
+    ''' Return sorted names of mechanisms used by a PopulationParams object
+
+        Collects mechanisms from the NEURON templates in Y_importParams, the 'mod' entries
+        of the synaptic mechanisms and the general synapse mod list.
+    '''
+    names = set(fullParams.mod_list)
+
+    for importDict in fullParams.Y_importParams.values():
+        names |= templateMechanismNames(importDict['fileName'])
+
+    for synMech in fullParams.Y_synapseMechParams.values():
+        names.add(synMech['mod'])
+
+    return sorted(names)
+
+
+def selectModFiles(names, path2mod=path2mod):
+    ''' Return sorted .mod files in path2mod defining any of names
+
+        Names without a .mod file (e.g., NEURON builtins like pas or List) are ignored.
+    '''
+    names = set(names)
+
+    return sorted(modFile for modFile in glob(join(path2mod, '*.mod'))
+                  if names.intersection(modMechanismNames(modFile)))
+
+
+def hashModFiles(modFiles):
+    ''' Return dictionary of .mod file basenames and the sha1 of their contents '''
+    hashes = {}
+    for modFile in modFiles:
+        hashes[basename(modFile)] = TCModel_Cache.hashFiles([modFile]).hexdigest()
+
+    return hashes
+
+
+def mechLibraryExists(buildDir):
+    ''' Check for compiled library written by nrnivmodl (layout depends on NEURON version) '''
+    return bool(glob(join(buildDir, '*', '.libs', 'libnrnmech.so')) or
+                glob(join(buildDir, '*', 'libnrnmech.so')))
+
+
+def buildMechanisms(names, path2mod=path2mod, numJobs=None):
+    ''' Compile the .mod files defining names and return the build directory for neuron.load_mechanisms()
+
+        Each set of mod files gets its own build directory in the cache, so switching between
+        sets does not trigger a rebuild. Within a directory, only files whose content hash
+        changed are copied (the rest keep their timestamps, so make skips them) and nrnivmodl
+        compiles with numJobs parallel jobs (default: number of cores).
+    '''
+    modFiles = selectModFiles(names, path2mod)
+    if not modFiles:
+        raise Exception, 'No .mod files in %s define any of %s' % (path2mod, names)
+
+    hashes = hashModFiles(modFiles)
+    setKey = hashlib.sha1(' '.join(sorted(hashes.keys()))).hexdigest()[:12]
+    buildDir = join(TCModel_Cache.path2cache, 'nrnmech_' + setKey)
+    manifestFile = join(buildDir, 'manifest.json')
+
+    if not exists(buildDir):
+        try:
+            os.makedirs(buildDir)
+        except OSError:
+            pass    # created by a concurrent process
+
+    # Serialize builds of the same set across concurrently started processes
+    with open(join(buildDir, '.lock'), 'w') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        manifest = {}
+        if exists(manifestFile):
+            with open(manifestFile) as f:
+                manifest = json.load(f)
+
+        if manifest == hashes and mechLibraryExists(buildDir):
+            return buildDir
+
+        # Only (re)copy changed .mod files
+        for modFile in modFiles:
+            name = basename(modFile)
+            if manifest.get(name) != hashes[name] or not exists(join(buildDir, name)):
+                shutil.copy(modFile, join(buildDir, name))
+
+        env = dict(os.environ)
+        env['MAKEFLAGS'] = '-j%d' % (numJobs or multiprocessing.cpu_count())
+        if subprocess.call(['nrnivmodl'], cwd=buildDir, env=env) != 0:
+            raise Exception, 'nrnivmodl failed in %s' % buildDir
+
+        with open(manifestFile, 'w') as f:
+            json.dump(hashes, f, indent=1, sort_keys=True)
+
+    return buildDir
+
+
+def loadMechanisms(fullParams, path2mod=path2mod):
+    ''' Build (if necessary) and load the mechanisms required by fullParams into NEURON '''
+    global _loadedMechDir
+    import neuron
+
+    buildDir = buildMechanisms(requiredMechanisms(fullParams), path2mod)
+
+    if _loadedMechDir is None:
+        neuron.load_mechanisms(buildDir)
+        _loadedMechDir = buildDir
+    elif _loadedMechDir != buildDir:
+        raise Exception, 'Mechanisms from %s already loaded, cannot load %s' % (_loadedMechDir, buildDir)
+
+    return buildDir
+
+
+def mechanismsDir():
+    ''' Return directory of the mechanism library loaded by loadMechanisms() (None if none yet) '''
+    return _loadedMechDir
+
+
+
+if __name__ == '__main__':
+
+    from TCModel_Params import PopulationParams
+
+    fullParams = PopulationParams()
+
+    # Build mechanism library ahead of a run, e.g., when creating a container image
+    names = requiredMechanisms(fullParams)
+    modFiles = selectModFiles(names)
+    print '\nCompiling %d of %d .mod files in %s\n' % (len(modFiles), len(glob(join(path2mod, '*.mod'))), path2mod)
+    print buildMechanisms(names)
@@ -0,0 +1,206 @@
+'''
+    TCModel_Cache.py contains content-addressed on-disk caches for TCModel_Run.py.
+    Expensive build products are stored under keys hashed from everything they depend on
+    so that repeated runs with unchanged inputs skip rebuilding them.
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import cPickle as pickle
+import hashlib
+import inspect
+import numpy as np
+import os
+from os.path import join, exists, splitext
+
+
+# Important paths for simulations
+path2cache = '.cache'
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def hashObject(obj, digest=None):
+    ''' Feed a (nested) parameter structure into a hash in an order independent way
+
+        Dictionaries are hashed by sorted keys and numpy arrays by dtype, shape and raw bytes
+        so that equal parameter sets always produce the same key.
+    '''
+    if digest is None:
+        digest = hashlib.sha1()
+
+    if isinstance(obj, dict):
+        digest.update('dict')
+        for key in sorted(obj.keys()):
+            hashObject(key, digest)
+            hashObject(obj[key], digest)
+    elif isinstance(obj, (list, tuple)):
+        digest.update(type(obj).__name__)
+        for elem in obj:
+            hashObject(elem, digest)
+    elif isinstance(obj, np.ndarray) and obj.dtype == object:
+        # e.g., ragged population sizes (raw bytes would be pointers)
+        digest.update('ndarray' + str(obj.shape))
+        hashObject(obj.tolist(), digest)
+    elif isinstance(obj, np.ndarray):
+        digest.update('ndarray' + str(obj.dtype) + str(obj.shape))
+        digest.update(np.ascontiguousarray(obj).tostring())
+    else:
+        digest.update(type(obj).__name__ + repr(obj))
+
+    return digest
+
+
+def hashFiles(fileNames, digest=None):
+    ''' Feed the contents of a list of files into a hash '''
+    if digest is None:
+        digest = hashlib.sha1()
+
+    for fileName in fileNames:
+        with open(fileName, 'rb') as f:
+            digest.update(f.read())
+
+    return digest
+
+
+def sourceFile(module):
+    ''' Return .py source path of an imported module (not the compiled .pyc) '''
+    return splitext(module.__file__)[0] + '.py'
+
+
+def cachePath(kind, key, ext='.pkl'):
+    ''' Return path of cache entry for a kind of build product and its key '''
+    return join(path2cache, kind + '_' + key + ext)
+
+
+def loadCache(kind, key):
+    ''' Return cached object for key or None if there is no (readable) entry '''
+    fileName = cachePath(kind, key)
+
+    if not exists(fileName):
+        return None
+
+    try:
+        with open(fileName, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        # Corrupt or stale entries are rebuilt (and overwritten) by the caller
+        return None
+
+
+def makeCacheDir():
+    ''' Create cache directory if it doesn't exist yet '''
+    if not exists(path2cache):
+        try:
+            os.makedirs(path2cache)
+        except OSError:
+            pass    # created by a concurrent process
+
+
+def saveCache(kind, key, obj):
+    ''' Store object under key using a compact binary pickle
+
+        Entries are written to a temporary file and renamed so concurrent processes
+        of a sweep never read a partially written entry.
+    '''
+    makeCacheDir()
+
+    fileName = cachePath(kind, key)
+    tmpName = fileName + '.%d.tmp' % os.getpid()
+
+    with open(tmpName, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpName, fileName)
+
+    return fileName
+
+
+def paramsCacheKey(params):
+    ''' Return key for a parameter object built by PopulationParams
+
+        Key covers the source of every module defining a class in the object's hierarchy
+        (i.e., class attributes and helper functions), GeneratedSynapseParams, the current
+        values of public class attributes (which may be changed at run time, e.g., the
+        conductance multipliers) and the instance state set before building, e.g., the
+        testing and includeGJ flags.
+    '''
+    import GeneratedSynapseParams
+
+    fileNames = [sourceFile(GeneratedSynapseParams)]
+    classAttrs = {}
+    for cls in type(params).__mro__:
+        if cls is not object:
+            fileName = splitext(inspect.getsourcefile(cls))[0] + '.py'
+            if fileName not in fileNames:
+                fileNames.append(fileName)
+            for name, value in vars(cls).items():
+                if not name.startswith('_') and not callable(value) and name not in classAttrs:
+                    classAttrs[name] = value
+
+    digest = hashFiles(fileNames)
+    hashObject(classAttrs, digest)
+    hashObject(params.__dict__, digest)
+
+    return digest.hexdigest()
+
+
+def loadedMechanisms():
+    ''' Return sorted names of all density mechanisms and point processes known to NEURON '''
+    from neuron import h
+
+    names = []
+    name = h.ref('')
+    for mtype in [0, 1]:    # 0: density mechanisms, 1: point processes
+        mechTypes = h.MechanismType(mtype)
+        for i in range(int(mechTypes.count())):
+            mechTypes.select(i)
+            mechTypes.selected(name)
+            names.append(name[0])
+
+    return sorted(names)
+
+
+def cellParamsCacheKey(importDict):
+    ''' Return key for a cell rule imported from a NEURON template
+
+        Key covers the template file, the import arguments, the mechanisms loaded into
+        NEURON (which determine the converted 'mechs' entries) and the NETPYNE version.
+    '''
+    import netpyne
+
+    digest = hashFiles([importDict['fileName']])
+    hashObject(importDict, digest)
+    hashObject(loadedMechanisms(), digest)
+    hashObject(getattr(netpyne, '__version__', ''), digest)
+
+    return digest.hexdigest()
+
+
+def importCachedCellParams(netParams, importDict, useCache=True):
+    ''' Add cell rule described by importDict (see PopulationParams._Y_import()) to netParams
+
+        On a cache hit the converted rule is loaded directly, i.e., the hoc template is never
+        interpreted or instantiated. Otherwise netParams.importCellParams() is called and
+        its result stored for the next run.
+    '''
+    label = importDict['label']
+    cacheKey = cellParamsCacheKey(importDict)
+
+    cellRule = loadCache('cellParams', cacheKey) if useCache else None
+    if cellRule is not None:
+        netParams.cellParams[label] = cellRule
+        return netParams.cellParams[label]
+
+    cellRule = netParams.importCellParams(label=label,
+                                          conds=importDict['conds'],
+                                          cellName=importDict['cellName'],
+                                          fileName=importDict['fileName'])
+
+    if useCache:
+        # netpyne Dict objects are converted to plain dicts before pickling
+        saveCache('cellParams', cacheKey, cellRule.todict() if hasattr(cellRule, 'todict') else cellRule)
+
+    return cellRule
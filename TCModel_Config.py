@@ -6,9 +6,10 @@
 '''
 
 # Import modules
+from itertools import product
 import os
-from os.path import join
-from TCModel_Params import PopulationParams
+from os.path import dirname, join
+from TCModel_Params import getPopulationParams
 
 
 
@@ -16,12 +17,16 @@ from TCModel_Params import PopulationParams
 ################################################################################
 ##### General batch configurations
 ################################################################################
-class BatchConfigs(PopulationParams):
-    def __init__(self):
-        ''' Class defining rules for how single simulation protocols change '''
+class BatchConfigs(object):
+    def __init__(self, params=None):
+        ''' Class defining rules for how single simulation protocols change
 
-        # Inherit params from *_Params file
-        PopulationParams.__init__(self)
+            params is the PopulationParams object shared with the network configuration
+            (defaults to the memoized TCModel_Params.getPopulationParams() build)
+        '''
+
+        # Use (not rebuild) params from *_Params file
+        self.params = params if params is not None else getPopulationParams()
 
     ####################################
     #                                  #
@@ -31,8 +36,8 @@ class BatchConfigs(PopulationParams):
     #                                  #
     ####################################
 
-        # Used as conditional flag for development (inherited from GeneralParams)
-        # self.testing = True
+        # Used as conditional flag for development (taken from GeneralParams)
+        self.testing = self.params.testing
 
         # Important paths for simulations
         if self.testing is True:
@@ -41,8 +46,8 @@ class BatchConfigs(PopulationParams):
             self.path2data = 'scratch'
         else:
             self.path2output = 'output'                  # grandparent output dir
-            self.path2figs = join(path2output,'figs')    # parent figure dir
-            self.path2data = join(path2output,'dat')     # parent data dir
+            self.path2figs = join(self.path2output,'figs')    # parent figure dir
+            self.path2data = join(self.path2output,'dat')     # parent data dir
 
             # TODO: subdirectories for various batch results
 
@@ -54,14 +59,66 @@ class BatchConfigs(PopulationParams):
     #                                  #
     ####################################
 
-        # Global batch specification
-        self.num_sims = 1
-
-        # # Necessary for NETPYNE batch object
-        # self.cfgFile
-        # self.netParamsFile
-        # self.params
-        # self.groupedParams
+        # Global batch specification (run by TCModel_Batch.runBatch())
+        self.num_sims = 1               # replicates of every run (simConfig seeds shifted by replicate)
+        self.batchLabel = 'batch'       # runs are saved in path2data/batchLabel/<run label>
+        self.batchParams = []           # grid, see addBatchParam()
+        self.batchRuns = []             # list of runs, see addBatchRun()
+
+        # Local process pool
+        self.numWorkers = None          # None: as many as cores and memory allow
+        self.memPerRun = 2.0            # expected peak memory of one run (GB)
+        self.maxRetries = 1             # reruns of a failed (crashed, timed out) run
+        self.runTimeout = None          # wall time limit of one run (s)
+        self.forkBatch = False          # build network once and fork every run from it (runBatchForked())
+        self.memPerFork = 0.5           # expected memory of a forked run beyond the shared network (GB)
+
+        # Example 2x2 grid plus one additional run
+        # self.addBatchParam('duration', [500, 1000])
+        # self.addBatchParam(('synMechParams', 'GABA_0', 'tau'), [0.5, 1.0])
+        # self.addBatchRun({'mergeSynapses' : True})
+
+        # Example sweep not changing the network (forkBatch = True)
+        # self.addBatchParam(('stimSourceParams', 'depol_step_current', 'amp'), [0.5, 1.0, 1.5])
+        # self.addBatchParam(('synMechParams', 'NMDA_0', 'g'), [1e-4, 2e-4, 4e-4])     # scales NMDA_0 NetCon weights
+        # self.num_sims = 3
+
+
+    def addBatchParam(self, label, values, grouped=False):
+        ''' Add parameter varied over the batch grid
+
+            label is either the name of a specs.SimConfig() attribute (e.g., 'duration'), of a build
+            option of SimulationConfigs (e.g., 'mergeSynapses') or a tuple path into specs.NetParams(),
+            e.g., ('synMechParams', 'AMPA_0', 'tau'). Grouped params vary together (same number of values).
+        '''
+        self.batchParams.append({'label' : label, 'values' : list(values), 'grouped' : grouped})
+
+    def addBatchRun(self, runParams):
+        ''' Add one run given as dictionary of label (see addBatchParam()) -> value '''
+        self.batchRuns.append(dict(runParams))
+
+    def batchRunList(self):
+        ''' Return list of dictionaries of label -> value of every run (without replicates)
+
+            Each ungrouped param is one axis of the grid and all grouped params together another one
+            (at the position of the first grouped param). Runs of addBatchRun() follow the grid.
+        '''
+        axes = []
+        grouped = [param for param in self.batchParams if param['grouped']]
+        for param in self.batchParams:
+            if not param['grouped']:
+                axes.append([[(param['label'], value)] for value in param['values']])
+            elif param is grouped[0]:
+                numValues = set(len(groupParam['values']) for groupParam in grouped)
+                if len(numValues) > 1:
+                    raise Exception, 'GROUPED BATCH PARAMS NEED THE SAME NUMBER OF VALUES'
+                axes.append([[(groupParam['label'], groupParam['values'][i]) for groupParam in grouped]
+                             for i in range(numValues.pop())])
+
+        runs = [dict(sum(combination, [])) for combination in product(*axes)] if axes else []
+        runs += [dict(run) for run in self.batchRuns]
+
+        return runs if runs else [{}]
 
 
 
@@ -69,11 +126,11 @@ class BatchConfigs(PopulationParams):
 ##### Simulation configurations
 ################################################################################
 class SimulationConfigs(BatchConfigs):
-    def __init__(self):
+    def __init__(self, params=None):
         ''' Class defining single simulation protocols - used by specs.SimConfig() from netpyne '''
 
         # Inherit parent class params
-        BatchConfigs.__init__(self)
+        BatchConfigs.__init__(self, params)
 
 
     ####################################
@@ -89,10 +146,22 @@ class SimulationConfigs(BatchConfigs):
         #  SIMULATIONS
         ###################################
         self.duration = (.2 + .8)*1e3         # runtime (equilibriation + simulation)*(s -> ms)
+        self.equilibration = .2*1e3           # settling from random initial potentials (ms)
         self.dt = 0.25                        # internal timestep (ms)
 
         self.verbose = False                   # show detailed messages
 
+        # Build options (applied by TCModel_Run.createNetwork(), not passed to specs.SimConfig())
+        self.mergeSynapses = False              # one point process per (cell, section, mechanism) ...
+        self.mergeSynMechs = ['AMPA', 'GABAA']  # ... for these linear mods (NOT NMDA due to saturation)
+        self.nativeConnectivity = False         # vectorized traubCellConn (TCModel_Connectivity) instead of netpyne's
+        self.loadBalance = True                 # with MPI: assign cells to ranks by estimated cost (TCModel_Parallel)
+        self.gapJunctions = 'netpyne'           # 'netpyne', 'transfer' (source_var/target_var) or 'implicit' (LinearMechanism), see TCModel_GapJunctions
+        self.nthreads = 1                       # threads per process (pc.nthread, cells partitioned by cost in TCModel_Parallel)
+        self.useStateCache = False              # restore equilibrated state instead of simulating equilibration (TCModel_State)
+        self.initMode = 'random'                # initial state of cells: 'random' (popParams vInit) or 'rest' (cached per template, TCModel_Rest)
+        self.restJitter = 0.                    # with initMode 'rest': SD of per cell offset of initial potentials (mV)
+
         ###################################
         #  DATA ACQUISITION
         ###################################
@@ -101,7 +170,7 @@ class SimulationConfigs(BatchConfigs):
         includedPopList = []
 
         # Unpackage .Y_pop_ids into one list (for recordTraces)
-        for layerLabels in self.Y_pop_ids:
+        for layerLabels in self.params.Y_pop_ids:
             for popLabel in layerLabels:
                 includedPopList.append(popLabel)
 
@@ -121,6 +190,18 @@ class SimulationConfigs(BatchConfigs):
 
         self.recordStep = 1             # downsampling for saved data (ms)
 
+        # Stream traces to HDF5 during the run instead of keeping them in memory (TCModel_Traces, needs h5py)
+        self.streamTraces = False
+        self.traceFlushInterval = 100.  # interval between writes, i.e., memory bound of traces (ms)
+
+        # Spikes as columnar arrays with population and time index (TCModel_Spikes) in <output prefix>_spikes
+        # NOTE: like savePickle, not when testing
+        self.saveSpikes = not self.testing
+
+        # Params, connections and traces as separate stores for lazy reading (TCModel_Results.RunResults)
+        # in <output prefix>_params.pkl, _conns and _traces (like savePickle, not when testing)
+        self.saveStores = not self.testing
+
 
         ###################################
         #  OUTPUT DETAILS
@@ -188,7 +269,35 @@ class SimulationConfigs(BatchConfigs):
             'analysis' : self.analysis,
         }
 
+    def outputPrefix(self, filename):
+        ''' Return prefix of the run's output files for simConfig filename (in path2data unless it has a directory) '''
+        return filename if dirname(filename) else join(self.path2data, filename)
+
+
+
+
+################################################################################
+##### Model configurations
+################################################################################
+class ModelConfigs(object):
+    def __init__(self, testing=True):
+        ''' Class composing network and simulation configurations around one parameter build
+
+            Example usage in run file:
+            >> fullConfigs = ModelConfigs()
+            >> netParams = specs.NetParams(netParamsDict=fullConfigs.netParamsDict)
+            >> simConfig = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
+        '''
+
+        # Population, synapse and projection dictionaries (built once per process)
+        self.params = getPopulationParams(testing)
+
+        # Simulation protocols referring to the same parameters
+        self.simConfigs = SimulationConfigs(self.params)
 
+        # Parent dictionaries for specs.NetParams() and specs.SimConfig()
+        self.netParamsDict = self.params.netParamsDict
+        self.simConfigDict = self.simConfigs.simConfigDict
 
 
 
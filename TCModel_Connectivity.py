@@ -0,0 +1,409 @@
+'''
+    TCModel_Connectivity.py contains a vectorized implementation of the 'traubCellConn'
+    connectivity rule used by every connParams entry from TCModel_Params._Y_project().
+
+    Every postsynaptic cell of a pathway receives 'numPreToPost' connections from presynaptic
+    cells drawn uniformly at random (with replacement, no self-connections), each on a
+    compartment drawn uniformly from the pathway's allowed compartments. All draws of a pathway
+    are made in one batched call from a stream seeded by the pathway label, so a pathway's
+    connections do not depend on which other pathways are generated.
+
+    Allowed compartments are integer lookup tables per (pre template, post template) pair and
+    synapses are placed by indexing per-cell section tables, i.e., without string handling.
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+from collections import OrderedDict as ODict
+import hashlib
+import json
+import numpy as np
+import os
+from os.path import exists
+import sys
+from GeneratedSynapseParams import comp_syn, comp_gap
+import TCModel_Cache
+
+
+# Arrays of a connectome pathway (gap junction pathways also have 'preComps', the remaining entries are connParams fields)
+connectomeArrays = ['indptr', 'preGids', 'postGids', 'comps', 'preComps']
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def popGidRanges(popParams):
+    ''' Return dictionary of (first gid, number of cells) per population
+
+        Gids are assigned consecutively in popParams order, as in netpyne.
+    '''
+    gidRanges = ODict()
+    first = 0
+    for pop, popParam in popParams.items():
+        gidRanges[pop] = (first, int(popParam['numCells']))
+        first += int(popParam['numCells'])
+
+    return gidRanges
+
+
+def pathwaySeed(seed, label):
+    ''' Return deterministic 32-bit seed for a pathway from a base seed and its label '''
+    return int(hashlib.sha1('%d_%s' % (seed, label)).hexdigest()[:8], 16)
+
+
+def popTemplates(popParams):
+    ''' Return dictionary of NEURON template name per population (from 'cellModel': <template>_mod) '''
+    return dict((pop, popParam['cellModel'][:-len('_mod')]) for pop, popParam in popParams.items())
+
+
+def placementTables(popParams, connParams, labels=None):
+    ''' Return dictionary of allowed compartment numbers (int32 array) per 'traubCellConn' pathway
+
+        One table is built per (pre template, post template) pair from comp_syn (or per template
+        from comp_gap for gap junctions) and shared by all pathways between those templates.
+        Pathways without an entry fall back to their 'sec' list.
+    '''
+    templates = popTemplates(popParams)
+
+    tables = {}
+    pathwayTables = {}
+    for label in traubPathways(connParams, labels):
+        connParam = connParams[label]
+        preTemp = templates[connParam['preConds']['pop']]
+        postTemp = templates[connParam['postConds']['pop']]
+
+        if connParam.get('gapJunction', False):
+            key = ('gap', postTemp)
+            comps = comp_gap.get('compallow_' + postTemp)
+        else:
+            key = (preTemp, postTemp)
+            comps = comp_syn.get('compallow_' + preTemp + '_to_' + postTemp)
+
+        if key not in tables:
+            tables[key] = np.array(comps, dtype=np.int32) if comps is not None else secsToComps(connParam['sec'])
+        pathwayTables[label] = tables[key]
+
+    return pathwayTables
+
+
+def sectionTable(cell):
+    ''' Return list indexed by compartment number of (section label, section dict) of a netpyne cell '''
+    secs = {}
+    for secLabel, sec in cell.secs.items():
+        secs[int(secLabel.split('_')[-1])] = (secLabel, sec)
+
+    table = [None]*(max(secs.keys()) + 1)
+    for comp, entry in secs.items():
+        table[comp] = entry
+
+    return table
+
+
+def addSynMech(sec, synLabel, synMechParam, loc=0.5):
+    ''' Create synaptic point process on a netpyne section dict (as netpyne's Cell.addSynMech()) '''
+    from neuron import h
+    from netpyne.specs import Dict
+
+    synMech = Dict({'label' : synLabel, 'loc' : loc})
+    for paramName, paramValue in synMechParam.items():
+        synMech[paramName] = paramValue
+
+    synMech['hObj'] = getattr(h, synMechParam['mod'])(loc, sec=sec['hObj'])
+    for paramName, paramValue in synMechParam.items():
+        if paramName not in ['label', 'mod', 'selfNetCon', 'loc']:
+            setattr(synMech['hObj'], paramName, paramValue)
+
+    sec.setdefault('synMechs', []).append(synMech)
+
+    return synMech
+
+
+def secsToComps(secs):
+    ''' Convert list of 'comp_<n>' section names into integer array of compartment numbers '''
+    return np.array([int(sec.split('_')[-1]) for sec in secs], dtype=np.int32)
+
+
+def traubCellConn(numPre, numPost, numPreToPost, comps, rng, synsPerConn=1, allowSelf=False):
+    ''' Return CSR arrays (indptr, pre, post, comp) of one pathway
+
+        indptr[i]:indptr[i+1] indexes the connections onto postsynaptic cell i, pre/post are
+        population-relative cell indices and comp the target compartment number(s) - with
+        shape (num conns, synsPerConn) if synsPerConn > 1.
+        If not allowSelf (recurrent pathways only) cell i never connects to itself.
+    '''
+    numPreToPost = int(numPreToPost)
+    numConns = numPost*numPreToPost
+
+    post = np.repeat(np.arange(numPost, dtype=np.int32), numPreToPost)
+
+    if allowSelf or numPre < 2:
+        pre = rng.randint(0, numPre, size=numConns).astype(np.int32)
+    else:
+        # Draw from numPre - 1 cells and skip over the postsynaptic cell itself
+        pre = rng.randint(0, numPre - 1, size=numConns).astype(np.int32)
+        pre[pre >= post] += 1
+
+    shape = (numConns, synsPerConn) if synsPerConn > 1 else numConns
+    comp = comps[rng.randint(0, len(comps), size=shape)]
+
+    indptr = np.arange(numPost + 1, dtype=np.int64)*numPreToPost
+
+    return indptr, pre, post, comp
+
+
+def generateConnectome(popParams, connParams, seed=1, labels=None):
+    ''' Return dictionary of CSR connectivity per 'traubCellConn' pathway in connParams
+
+        Each entry contains gid arrays ready for instantiation:
+            'indptr' : offsets of each postsynaptic cell's connections
+            'preGids', 'postGids' : network gids (int32)
+            'comps' : target compartment numbers (int32)
+            'preComps' : presynaptic compartment numbers (int32, gap junction pathways only)
+        plus the connParams fields needed to create the connections ('synMech', 'weight', ...).
+    '''
+    gidRanges = popGidRanges(popParams)
+    tables = placementTables(popParams, connParams, labels)
+
+    connectome = ODict()
+    for label in traubPathways(connParams, labels):
+        connParam = connParams[label]
+
+        prePop = connParam['preConds']['pop']
+        postPop = connParam['postConds']['pop']
+        preFirst, numPre = gidRanges[prePop]
+        postFirst, numPost = gidRanges[postPop]
+        synsPerConn = connParam.get('synsPerConn') or 1
+
+        rng = np.random.RandomState(pathwaySeed(seed, label))
+        indptr, pre, post, comp = traubCellConn(numPre, numPost, connParam['numPreToPost'],
+                                                tables[label], rng,
+                                                synsPerConn=synsPerConn,
+                                                allowSelf=(prePop != postPop))
+
+        connectome[label] = {
+                'indptr' : indptr,
+                'preGids' : pre + np.int32(preFirst),
+                'postGids' : post + np.int32(postFirst),
+                'comps' : comp,
+        }
+
+        # Gap junctions couple a compartment of each cell, drawn independently from the same table
+        if connParam.get('gapJunction', False):
+            connectome[label]['preComps'] = tables[label][rng.randint(0, len(tables[label]), size=comp.shape)]
+
+        connectome[label].update(pathwayFields(connParam))
+
+    return connectome
+
+
+def traubPathways(connParams, labels=None):
+    ''' Return sorted labels of 'traubCellConn' entries in connParams (optionally only those in labels) '''
+    return [label for label in sorted(connParams.keys())
+            if connParams[label].get('connFunc') == 'traubCellConn' and (labels is None or label in labels)]
+
+
+def pathwayFields(connParam):
+    ''' Return the (non-structural) connParams fields needed to instantiate a pathway '''
+    return {'synMech' : connParam['synMech'],
+            'weight' : connParam.get('weight'),
+            'delay' : connParam.get('delay'),
+            'synsPerConn' : connParam.get('synsPerConn') or 1,
+            'gapJunction' : connParam.get('gapJunction', False),
+            }
+
+
+def connectomeCacheKey(popParams, connParams, seed=1, labels=None):
+    ''' Return key of the connectivity generated from popParams and connParams
+
+        Key covers what determines the connectivity structure: population sizes, pathway
+        populations, numPreToPost (num_conns), allowed sections (comp_syn/comp_gap),
+        synsPerConn, the seed and this file (the algorithm).
+        Weights, delays and synMech labels are not part of the key.
+    '''
+    structure = {}
+    for label in traubPathways(connParams, labels):
+        connParam = connParams[label]
+        structure[label] = [connParam['preConds']['pop'], connParam['postConds']['pop'],
+                            int(connParam['numPreToPost']), list(connParam['sec']),
+                            connParam.get('synsPerConn') or 1]
+
+    numCells = dict((pop, int(popParam['numCells'])) for pop, popParam in popParams.items())
+
+    digest = TCModel_Cache.hashFiles([TCModel_Cache.sourceFile(sys.modules[__name__])])
+    TCModel_Cache.hashObject([structure, numCells, seed], digest)
+
+    return digest.hexdigest()
+
+
+def saveConnectome(connectome, fileName, compress=True):
+    ''' Save connectome as (compressed) .npz
+
+        Pathways are concatenated into one flat array per field (see connectomeArrays) with
+        offsets/shapes and the remaining fields stored as JSON metadata, which keeps loading
+        cost independent of the number of pathways.
+    '''
+    arrays = {}
+    meta = []
+    for name in connectomeArrays:
+        parts = [pathway[name].ravel() for pathway in connectome.values() if name in pathway]
+        if parts:
+            arrays[name] = np.concatenate(parts)
+
+    for label, pathway in connectome.items():
+        meta.append([label, dict((key, value) for key, value in pathway.items() if key not in connectomeArrays),
+                     dict((name, pathway[name].shape) for name in connectomeArrays if name in pathway)])
+
+    tmpName = fileName + '.%d.tmp.npz' % os.getpid()
+    (np.savez_compressed if compress else np.savez)(tmpName, meta=json.dumps(meta), **arrays)
+    os.rename(tmpName, fileName)
+
+
+def loadConnectome(fileName):
+    ''' Return connectome saved by saveConnectome() (pathway arrays are views of the flat arrays) '''
+    data = np.load(fileName)
+    arrays = dict((name, data[name]) for name in connectomeArrays if name in data.files)
+    offsets = dict((name, 0) for name in arrays)
+
+    connectome = ODict()
+    for label, fields, shapes in json.loads(str(data['meta'])):
+        pathway = dict((str(key), value) for key, value in fields.items())
+        for name, shape in shapes.items():
+            name = str(name)
+            size = int(np.prod(shape))
+            pathway[name] = arrays[name][offsets[name]:offsets[name] + size].reshape(shape)
+            offsets[name] += size
+        connectome[str(label)] = pathway
+
+    return connectome
+
+
+def getConnectome(popParams, connParams, seed=1, useCache=True, labels=None):
+    ''' Return connectome for popParams/connParams, reloading it from cache if the structure is unchanged
+
+        Fields not covered by the cache key (synMech, weight, delay, ...) are always taken from
+        connParams, so changing e.g. conductances does not require regenerating connectivity.
+        If labels is given, only those pathways are generated.
+    '''
+    fileName = TCModel_Cache.cachePath('connectome', connectomeCacheKey(popParams, connParams, seed, labels), '.npz')
+
+    if useCache and exists(fileName):
+        connectome = loadConnectome(fileName)
+        for label, pathway in connectome.items():
+            pathway.update(pathwayFields(connParams[label]))
+        return connectome
+
+    connectome = generateConnectome(popParams, connParams, seed, labels)
+
+    if useCache:
+        TCModel_Cache.makeCacheDir()
+        saveConnectome(connectome, fileName)
+
+    return connectome
+
+
+def cellPositions():
+    ''' Return (N x 3) array of x, y, z positions (um) of all cells of the network, indexed by gid '''
+    from netpyne import sim
+
+    allCellTags = sim._gatherAllCellTags()
+    positions = np.zeros((len(allCellTags), 3))
+    for gid, tags in allCellTags.items():
+        positions[gid] = [tags['x'], tags['y'], tags['z']]
+
+    return positions
+
+
+def pathwayDelays(delay, preGids, postGids, positions, netParams):
+    ''' Return array of delays (ms) of a pathway's connections for a string function delay
+
+        Vectorized equivalent of netpyne's evaluation of e.g. 'minDelay + dist_3D/propVelocity':
+        the distance variables (dist_3D, dist_2D (x-z plane), dist_x, dist_y, dist_z) are
+        computed from positions (see cellPositions()) and other names are numeric netParams attributes.
+    '''
+    diff = np.abs(positions[preGids] - positions[postGids])
+
+    variables = dict((key, value) for key, value in netParams.__dict__.items() if isinstance(value, (int, float)))
+    variables.update({'exp' : np.exp, 'sqrt' : np.sqrt, 'log' : np.log,
+                      'dist_3D' : np.sqrt(np.sum(diff**2, axis=1)),
+                      'dist_2D' : np.sqrt(diff[:, 0]**2 + diff[:, 2]**2),
+                      'dist_x' : diff[:, 0], 'dist_y' : diff[:, 1], 'dist_z' : diff[:, 2]})
+
+    return np.broadcast_to(eval(delay, {'__builtins__' : {}}, variables), len(preGids)).astype(float)
+
+
+def instantiateConnectome(connectome, netParams):
+    ''' Create synaptic point processes and NetCons for the local cells of each pathway
+
+        Equivalent to netpyne's _addCellConn()/Cell.addConn() for each (pre, post) pair but driven
+        directly by the connectome arrays: sections are resolved by compartment number through
+        one section table per cell and the resulting structures (cell.conns, sec['synMechs'])
+        are the ones netpyne creates. Gap junction pathways are skipped (created by netpyne).
+        String function delays are evaluated per connection with pathwayDelays().
+        Returns number of connections created on this rank.
+    '''
+    from netpyne import sim
+    from netpyne.specs import Dict
+
+    synMechParams = netParams.synMechParams
+    threshold = netParams.defaultThreshold
+    cellSecs = {}   # section table of each local postsynaptic cell
+    positions = None
+
+    num_conns = 0
+    for label, pathway in connectome.items():
+        if pathway['gapJunction']:
+            continue
+
+        synMechs = pathway['synMech'] if isinstance(pathway['synMech'], list) else [pathway['synMech']]
+        weight = pathway['weight'] if pathway['weight'] is not None else netParams.defaultWeight
+        delay = pathway['delay'] if pathway['delay'] is not None else netParams.defaultDelay
+
+        indptr = pathway['indptr']
+        postGids = pathway['postGids']
+        preGids = pathway['preGids'].tolist()
+        comps = pathway['comps'].tolist()
+
+        if isinstance(delay, basestring):
+            if positions is None:
+                positions = cellPositions()
+            delays = pathwayDelays(delay, pathway['preGids'], postGids, positions, netParams).tolist()
+        else:
+            delays = [delay]*len(preGids)
+
+        for postIndex in range(len(indptr) - 1):
+            start, stop = indptr[postIndex], indptr[postIndex + 1]
+            if start == stop:
+                continue
+
+            postGid = int(postGids[start])
+            if postGid not in sim.net.gid2lid:
+                continue    # cell lives on another rank
+            postCell = sim.net.cells[sim.net.gid2lid[postGid]]
+
+            if postGid not in cellSecs:
+                cellSecs[postGid] = sectionTable(postCell)
+            secs = cellSecs[postGid]
+
+            for i in xrange(start, stop):
+                secLabel, sec = secs[comps[i]]
+                for synLabel in synMechs:
+                    synMech = addSynMech(sec, synLabel, synMechParams[synLabel])
+
+                    netcon = sim.pc.gid_connect(preGids[i], synMech['hObj'])
+                    netcon.weight[0] = weight
+                    netcon.delay = delays[i]
+                    netcon.threshold = threshold
+
+                    postCell.conns.append(Dict({'preGid' : preGids[i],
+                                                'sec' : secLabel,
+                                                'loc' : 0.5,
+                                                'synMech' : synLabel,
+                                                'weight' : weight,
+                                                'delay' : delays[i],
+                                                'label' : label,
+                                                'hObj' : netcon}))
+                num_conns += 1
+
+    return num_conns
@@ -0,0 +1,214 @@
+'''
+    TCModel_GapJunctions.py creates the electrical couplings of the gap junction pathways
+    (gj_<pop> entries of connParams, 'gapJunction': True) from the connectome generated by
+    TCModel_Connectivity.py.
+
+    Every junction couples a compartment of each of two cells with one gGapPar point process
+    per side (par_ggap.mod), each reading the voltage of the other side through its vpeer.
+    Voltages are exchanged with ParallelContext source_var()/target_var(), so coupled cells
+    may live on different ranks. Transfer ids (sgids) follow arithmetically from a junction's
+    position in the connectome, so every rank sets up its ends independently and a single
+    setup_transfer() creates all transfers at once.
+
+    Alternatively (implicit=True) all junctions of a pathway whose two cells are on the same
+    rank are combined into one sparse coupling matrix of a LinearMechanism, which NEURON solves
+    together with the cable equations (no lag of vpeer by one step, so stable for larger dt).
+    Junctions between ranks still use the explicit transfer.
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import numpy as np
+from TCModel_Connectivity import sectionTable, addSynMech
+
+
+# LinearMechanism objects (with their matrices, vectors and section lists) of implicit couplings
+_linearMechanisms = []
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def gapPathways(connectome):
+    ''' Return labels of gap junction pathways of a connectome (in connectome order) '''
+    return [label for label, pathway in connectome.items() if pathway['gapJunction']]
+
+
+def junctionTable(connectome):
+    ''' Return dictionary of flat per junction arrays over all gap junction pathways
+
+        'pathway' (index into 'labels'), 'preGids', 'postGids', 'preComps', 'comps', 'weights'.
+        A connection with synsPerConn > 1 contributes synsPerConn junctions. Junction j has
+        sgid 2*j for the voltage of its postsynaptic and 2*j + 1 for its presynaptic compartment.
+    '''
+    labels = gapPathways(connectome)
+    parts = dict((name, []) for name in ['pathway', 'preGids', 'postGids', 'preComps', 'comps', 'weights'])
+
+    for index, label in enumerate(labels):
+        pathway = connectome[label]
+        synsPerConn = pathway['synsPerConn']
+        numJunctions = pathway['comps'].size
+
+        parts['pathway'].append(np.full(numJunctions, index, dtype=np.int32))
+        parts['preGids'].append(np.repeat(pathway['preGids'], synsPerConn))
+        parts['postGids'].append(np.repeat(pathway['postGids'], synsPerConn))
+        parts['preComps'].append(pathway['preComps'].ravel())
+        parts['comps'].append(pathway['comps'].ravel())
+
+        # One weight per junction of a connection (connParams 'weight' list of synsPerConn values)
+        weights = pathway['weight'] if pathway['weight'] is not None else 1.
+        parts['weights'].append(np.resize(np.asarray(weights, dtype=float), numJunctions))
+
+    table = {'labels' : labels}
+    for name, arrays in parts.items():
+        table[name] = np.concatenate(arrays) if arrays else np.zeros(0)
+
+    return table
+
+
+def addJunctionEnd(cell, secs, comp, synLabel, synMechParam, weight, sourceSgid, targetSgid, peerGid, label):
+    ''' Create the gGapPar of one side of a junction and register its voltage transfers '''
+    from netpyne import sim
+    from netpyne.specs import Dict
+
+    secLabel, sec = secs[comp]
+    synMech = addSynMech(sec, synLabel, synMechParam)
+    synMech['hObj'].weight = weight
+
+    sim.pc.source_var(sec['hObj'](0.5)._ref_v, sourceSgid, sec=sec['hObj'])
+    sim.pc.target_var(synMech['hObj'], synMech['hObj']._ref_vpeer, targetSgid)
+
+    cell.conns.append(Dict({'preGid' : peerGid,
+                            'sec' : secLabel,
+                            'loc' : 0.5,
+                            'synMech' : synLabel,
+                            'weight' : weight,
+                            'gapJunction' : True,
+                            'sgid' : sourceSgid,
+                            'label' : label}))
+
+
+def couplingMatrix(nodesA, nodesB, conductances, numNodes):
+    ''' Return (rows, cols, values) of the sparse conductance matrix of junctions between node pairs
+
+        Every junction of conductance g (uS) between nodes a and b adds g to (a, a) and (b, b)
+        and -g to (a, b) and (b, a); duplicate entries are summed.
+    '''
+    rows = np.concatenate([nodesA, nodesB, nodesA, nodesB])
+    cols = np.concatenate([nodesA, nodesB, nodesB, nodesA])
+    values = np.concatenate([conductances, conductances, -conductances, -conductances])
+
+    keys, inverse = np.unique(rows.astype(np.int64)*numNodes + cols, return_inverse=True)
+    summed = np.bincount(inverse, weights=values)
+
+    return keys//numNodes, keys % numNodes, summed
+
+
+def addLinearCoupling(junctions, table, connectome, netParams, localCell):
+    ''' Create one LinearMechanism coupling the local cells of the given junctions (of one pathway)
+
+        c*dv/dt + g*v = b with c = b = 0 and g the coupling matrix, i.e., current into every
+        coupled segment of sum over its junctions of weight*g_gap*(v_peer - v) (nA), as gGapPar.
+    '''
+    from neuron import h
+    from netpyne.specs import Dict
+
+    label = table['labels'][table['pathway'][junctions[0]]]
+    synLabel = connectome[label]['synMech']
+    conductances = table['weights'][junctions]*netParams.synMechParams[synLabel]['g']
+
+    # One node per distinct coupled (gid, compartment)
+    numComps = int(max(table['comps'].max(), table['preComps'].max())) + 1
+    ends = np.concatenate([table['postGids'][junctions].astype(np.int64)*numComps + table['comps'][junctions],
+                           table['preGids'][junctions].astype(np.int64)*numComps + table['preComps'][junctions]])
+    nodeKeys, nodeIndex = np.unique(ends, return_inverse=True)
+    numNodes = len(nodeKeys)
+
+    rows, cols, values = couplingMatrix(nodeIndex[:len(junctions)], nodeIndex[len(junctions):], conductances, numNodes)
+    g = h.Matrix(numNodes, numNodes, 2)     # sparse
+    for row, col, value in zip(rows.tolist(), cols.tolist(), values.tolist()):
+        g.setval(row, col, value)
+    c = h.Matrix(numNodes, numNodes, 2)
+
+    sl = h.SectionList()
+    for key in nodeKeys.tolist():
+        cell, secs = localCell(int(key//numComps))
+        sl.append(sec=secs[int(key % numComps)][1]['hObj'])
+    xvec = h.Vector(numNodes).fill(0.5)
+    y = h.Vector(numNodes)
+    b = h.Vector(numNodes)
+
+    linearMechanism = h.LinearMechanism(c, g, y, b, sl, xvec)
+    _linearMechanisms.append({'label' : label, 'hObj' : linearMechanism, 'g' : g, 'c' : c,
+                              'y' : y, 'b' : b, 'sl' : sl, 'xvec' : xvec})
+
+    # Record both ends of every junction as netpyne connections (no point process)
+    for j in junctions.tolist():
+        for gid, comp, peerGid in [(table['postGids'][j], table['comps'][j], table['preGids'][j]),
+                                   (table['preGids'][j], table['preComps'][j], table['postGids'][j])]:
+            cell, secs = localCell(int(gid))
+            cell.conns.append(Dict({'preGid' : int(peerGid),
+                                    'sec' : secs[int(comp)][0],
+                                    'loc' : 0.5,
+                                    'synMech' : synLabel,
+                                    'weight' : float(table['weights'][j]),
+                                    'gapJunction' : 'implicit',
+                                    'label' : label}))
+
+    return 2*len(junctions)
+
+
+def instantiateGapJunctions(connectome, netParams, implicit=False, sgidOffset=0):
+    ''' Create both sides of every gap junction with a local cell and set up the voltage transfers
+
+        If implicit, junctions between two local cells are coupled by one LinearMechanism per
+        pathway (see addLinearCoupling()) and only the remaining ones by voltage transfer.
+        Must be called after sim.net.createCells() on every rank (setup_transfer() is collective).
+        sgidOffset shifts all transfer ids, e.g., to avoid those of other transfers.
+        Returns number of junction ends created on this rank.
+    '''
+    from netpyne import sim
+
+    table = junctionTable(connectome)
+    gid2lid = sim.net.gid2lid
+    localGids = np.array(sorted(gid2lid.keys()), dtype=np.int64)
+    cellSecs = {}
+
+    def localCell(gid):
+        if gid not in cellSecs:
+            cellSecs[gid] = sectionTable(sim.net.cells[gid2lid[gid]])
+        return sim.net.cells[gid2lid[gid]], cellSecs[gid]
+
+    postLocal = np.in1d(table['postGids'], localGids)
+    preLocal = np.in1d(table['preGids'], localGids)
+
+    num_ends = 0
+    if implicit:
+        bothLocal = postLocal & preLocal
+        for index in range(len(table['labels'])):
+            junctions = np.flatnonzero(bothLocal & (table['pathway'] == index))
+            if len(junctions):
+                num_ends += addLinearCoupling(junctions, table, connectome, netParams, localCell)
+        postLocal &= ~bothLocal
+        preLocal &= ~bothLocal
+
+    for side, local, gids, comps, peerGids in [('post', postLocal, table['postGids'], table['comps'], table['preGids']),
+                                               ('pre', preLocal, table['preGids'], table['preComps'], table['postGids'])]:
+
+        # Junction ends on this rank (all others are created by the ranks owning their cells)
+        for j in np.flatnonzero(local).tolist():
+            label = table['labels'][table['pathway'][j]]
+            synLabel = connectome[label]['synMech']
+            sourceSgid = sgidOffset + 2*j + (side == 'pre')
+            targetSgid = sgidOffset + 2*j + (side == 'post')
+
+            cell, secs = localCell(int(gids[j]))
+            addJunctionEnd(cell, secs, int(comps[j]), synLabel, netParams.synMechParams[synLabel],
+                           float(table['weights'][j]), sourceSgid, targetSgid, int(peerGids[j]), label)
+            num_ends += 1
+
+    sim.pc.setup_transfer()
+
+    return num_ends
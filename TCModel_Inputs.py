@@ -0,0 +1,245 @@
+'''
+    TCModel_Inputs.py generates Poisson spike trains for background drive of the network.
+
+    All trains of a population are drawn together in a few array operations and returned in
+    a flat layout: times (ms) of all trains concatenated, with offsets such that train i is
+    times[offsets[i]:offsets[i + 1]] (sorted). Rates may be stationary (scalar or one per
+    train) or time-varying (by thinning a stationary train at the maximum rate). Every
+    population gets its own random stream derived from a seed and its label, so its trains
+    are reproducible independent of the order or number of populations generated.
+
+    Ectopic axonal spikes (ectopicTargetParams of netParams, see TCModel_Run.addStimulation())
+    are replayed from such trains by one PatternStim per target population instead of one
+    NetStim per cell. Each target cell receives its own Poisson train with the rate of the
+    NetStim source (noise >= 1, i.e., Poisson), through a NetCon from a virtual gid.
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import numpy as np
+import zlib
+from TCModel_Connectivity import popGidRanges, addSynMech
+
+
+# Ectopic inputs of this rank: per (target, population) PatternStim, its vectors and NetCons
+_ectopicInputs = []
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def populationStream(label, seed=1):
+    ''' Return numpy RandomState for population label (same seed and label -> same stream) '''
+    return np.random.RandomState([seed, zlib.crc32(label) & 0xffffffff])
+
+
+def trainOffsets(counts):
+    ''' Return offsets (length n + 1) of n trains with the given numbers of spikes '''
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    return offsets
+
+
+def trainIndex(offsets):
+    ''' Return index of the train of every spike, e.g., to map trains onto gids '''
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def poissonTrains(num, rate, tstart, tstop, rng=None):
+    ''' Return (times, offsets) of num stationary Poisson trains between tstart and tstop (ms)
+
+        rate (Hz) is a scalar or an array with one rate per train.
+    '''
+    if rng is None:
+        rng = np.random.RandomState()
+
+    counts = rng.poisson(np.broadcast_to(np.asarray(rate, dtype=float), (num,))*(tstop - tstart)*1e-3)
+    offsets = trainOffsets(counts)
+
+    # Uniform times given the counts, sorted within every train by one sort of train index + time
+    index = trainIndex(offsets)
+    keys = index + rng.random_sample(offsets[-1])
+    keys.sort()
+    times = tstart + (tstop - tstart)*(keys - index)
+
+    return times, offsets
+
+
+def thinTrains(times, offsets, keepProb, rng=None):
+    ''' Return (times, offsets) keeping every spike with probability keepProb (array like times) '''
+    if rng is None:
+        rng = np.random.RandomState()
+
+    keep = rng.random_sample(len(times)) < keepProb
+    counts = np.bincount(trainIndex(offsets)[keep], minlength=len(offsets) - 1)
+
+    return times[keep], trainOffsets(counts)
+
+
+def inhomogeneousPoissonTrains(num, rateFunc, maxRate, tstart, tstop, rng=None):
+    ''' Return (times, offsets) of num Poisson trains with time-varying rate between tstart and tstop (ms)
+
+        rateFunc maps an array of times (ms) and the array of their train indices to rates (Hz),
+        which must not exceed maxRate (Hz), e.g., lambda t, i: 10*(1 + np.sin(2*np.pi*t/100.)).
+    '''
+    if rng is None:
+        rng = np.random.RandomState()
+
+    times, offsets = poissonTrains(num, maxRate, tstart, tstop, rng)
+    rates = np.broadcast_to(np.asarray(rateFunc(times, trainIndex(offsets)), dtype=float), times.shape)
+    if rates.size and rates.max() > maxRate*(1 + 1e-9):
+        raise Exception, 'RATE %g Hz EXCEEDS maxRate %g Hz' % (rates.max(), maxRate)
+
+    return thinTrains(times, offsets, rates/maxRate, rng)
+
+
+def populationTrains(label, num, rate, tstart, tstop, seed=1, rateFunc=None):
+    ''' Return (times, offsets) of the trains of population label from its own stream
+
+        Stationary with rate (Hz) or, if rateFunc is given (see inhomogeneousPoissonTrains()),
+        time-varying with rate as the maximum rate.
+    '''
+    rng = populationStream(label, seed)
+
+    if rateFunc is None:
+        return poissonTrains(num, rate, tstart, tstop, rng)
+    else:
+        return inhomogeneousPoissonTrains(num, rateFunc, rate, tstart, tstop, rng)
+
+
+def splitTrains(times, offsets):
+    ''' Return list of per train arrays of a flat (times, offsets) layout '''
+    return np.split(times, offsets[1:-1])
+
+
+def stationaryPoisson(nsyn, lambd, tstart, tstop, rng=None):
+    ''' Generates nsyn stationary possion processes with rate lambda between tstart and tstop
+
+        List of arrays version of poissonTrains() (the flat layout is preferred)
+    '''
+    return splitTrains(*poissonTrains(nsyn, lambd, tstart, tstop, rng))
+
+
+def sourceRate(sourceParam):
+    ''' Return rate (Hz) of a NetStim source of stimSourceParams ('rate' in Hz or 'interval' in ms) '''
+    if 'rate' in sourceParam:
+        return float(sourceParam['rate'])
+
+    return 1e3/sourceParam['interval']
+
+
+def targetPops(popParams, conds):
+    ''' Return populations (in popParams order) all of whose cells satisfy conds of a stim target
+
+        Conditions on 'pop', 'cellType', 'cellModel' (value or list of values) and 'yrange' /
+        'yRange' (population depth range within [min, max]) are supported.
+    '''
+    pops = []
+    for pop, popParam in popParams.items():
+        match = True
+        for key, cond in conds.items():
+            if key in ['yrange', 'yRange']:
+                yRange = popParam['yRange']
+                match &= cond[0] <= yRange[0] and yRange[1] <= cond[1]
+            else:
+                value = pop if key == 'pop' else popParam.get(key)
+                match &= value in cond if isinstance(cond, list) else value == cond
+        if match:
+            pops.append(pop)
+
+    return pops
+
+
+def ectopicDelay(target, netParams):
+    ''' Return NetCon delay of an ectopic target (its 'delay' if positive, else netParams minDelay) '''
+    return target['delay'] if target.get('delay', 0) > 0 else netParams.minDelay
+
+
+def ectopicEvents(label, pop, netParams, tstop, seed=1):
+    ''' Return (times, gid offsets) of the sorted events of ectopic target label onto population pop
+
+        Train i is the input of cell i of pop. The delay of the NetCons (> 0 so it does not
+        limit the interval between spike exchanges) is taken out of the event times, so input
+        arrives between the source's start and tstop.
+    '''
+    target = netParams.ectopicTargetParams[label]
+    source = netParams.stimSourceParams[target['source']]
+    delay = ectopicDelay(target, netParams)
+    first, numCells = popGidRanges(netParams.popParams)[pop]
+
+    times, offsets = populationTrains(label + '->' + pop, numCells, sourceRate(source),
+                                      source.get('start', 0.) + delay, tstop + delay, seed)
+    gids = first + trainIndex(offsets)
+    order = np.argsort(times, kind='mergesort')
+
+    return times[order] - delay, gids[order]
+
+
+def instantiateEctopicInput(netParams, tstop, seed=1):
+    ''' Create synapses and PatternStims replaying ectopic spikes onto the local cells of all targets
+
+        Every target cell gets a synapse (target 'synMech', default 'exc') on its target section,
+        connected with pc.gid_connect() from virtual gid ((k + 1)*number of cells + gid) for the
+        k-th target (sorted labels), i.e., gids no cell owns and distinct for every target, so
+        targets sharing a population each drive their own synapses. Must be called after
+        sim.net.createCells(). Returns number of synapses created.
+    '''
+    from neuron import h
+    from netpyne import sim
+    from netpyne.specs import Dict
+
+    gidRanges = popGidRanges(netParams.popParams)
+    numTotal = sum(numCells for _, numCells in gidRanges.values())
+
+    num_syns = 0
+    for k, (label, target) in enumerate(sorted(netParams.ectopicTargetParams.items())):
+        gidOffset = (k + 1)*numTotal
+        synLabel = target.get('synMech', 'exc')
+        delay = ectopicDelay(target, netParams)
+
+        for pop in targetPops(netParams.popParams, target['conds']):
+            first, numCells = gidRanges[pop]
+            localGids = [gid for gid in range(first, first + numCells) if gid in sim.net.gid2lid]
+
+            netCons = []
+            for gid in localGids:
+                cell = sim.net.cells[sim.net.gid2lid[gid]]
+                synMech = addSynMech(cell.secs[target['sec']], synLabel, netParams.synMechParams[synLabel], target.get('loc', 0.5))
+                netCon = sim.pc.gid_connect(gidOffset + gid, synMech['hObj'])
+                netCon.weight[0] = target.get('weight', 1)
+                netCon.delay = delay
+                netCons.append(netCon)
+
+                cell.conns.append(Dict({'preGid' : 'PatternStim',
+                                        'preLabel' : target['source'],
+                                        'sec' : target['sec'],
+                                        'loc' : target.get('loc', 0.5),
+                                        'synMech' : synLabel,
+                                        'weight' : target.get('weight', 1),
+                                        'delay' : delay,
+                                        'hObj' : netCon,
+                                        'label' : label}))
+
+            # Events of all cells of the population, those of other ranks have no target here
+            patternStim = h.PatternStim()
+            patternStim.fake_output = 1     # virtual gids are not owned by any rank
+            tvec, gidvec = h.Vector(), h.Vector()
+            _ectopicInputs.append({'label' : label, 'pop' : pop, 'hObj' : patternStim,
+                                   'tvec' : tvec, 'gidvec' : gidvec, 'gidOffset' : gidOffset, 'netCons' : netCons})
+            num_syns += len(netCons)
+
+    updateEctopicInput(netParams, tstop, seed)
+
+    return num_syns
+
+
+def updateEctopicInput(netParams, tstop, seed=1):
+    ''' (Re)generate the events of all ectopic inputs, e.g., for another seed or changed source rates '''
+    for ectopicInput in _ectopicInputs:
+        times, gids = ectopicEvents(ectopicInput['label'], ectopicInput['pop'], netParams, tstop, seed)
+        ectopicInput['tvec'].from_python(times)
+        ectopicInput['gidvec'].from_python((ectopicInput['gidOffset'] + gids).astype(float))
+        ectopicInput['hObj'].play(ectopicInput['tvec'], ectopicInput['gidvec'])
@@ -0,0 +1,192 @@
+'''
+    TCModel_Network.py contains operations on the instantiated network (netpyne sim.net)
+    used by TCModel_Run.py after cells and connections are created, and updates of the
+    live network between runs (e.g., synaptic strengths for parameter scans).
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+from collections import OrderedDict as ODict
+
+
+# synMechParams 'g' of labels at their first update by updateSynapses() (NetCon weights scale from it)
+_builtConductances = {}
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def countSynMechs(cells=None):
+    ''' Return number of synaptic point processes on (local) cells '''
+    from netpyne import sim
+
+    if cells is None:
+        cells = sim.net.cells
+
+    return sum(len(sec.get('synMechs', [])) for cell in cells for sec in cell.secs.values())
+
+
+def mergeSynapses(mods=('AMPA', 'GABAA')):
+    ''' Share one point process per (cell, section, loc, mechanism label) between incoming NetCons
+
+        Valid for mechanisms linear in their inputs (ampa.mod, gabaa.mod): the summed response of
+        one instance to all events equals the sum of responses of one instance per event, as the
+        NetCon weights carry the conductance. NMDA is not linear (saturation) so must not be merged.
+        Must be called after sim.net.connectCells(). Returns number of point processes removed.
+    '''
+    from netpyne import sim
+
+    synMechParams = sim.net.params.synMechParams
+    mergeLabels = set(label for label, synMech in synMechParams.items() if synMech.get('mod') in mods)
+
+    num_removed = 0
+    for cell in sim.net.cells:
+
+        # Map hoc name of every redundant point process to the one kept
+        replacements = {}
+        for sec in cell.secs.values():
+            kept = ODict()
+            synMechs = []
+            for synMech in sec.get('synMechs', []):
+                if synMech['label'] not in mergeLabels:
+                    synMechs.append(synMech)
+                    continue
+
+                key = (synMech['label'], synMech['loc'])
+                if key in kept:
+                    replacements[synMech['hObj'].hname()] = kept[key]['hObj']
+                else:
+                    kept[key] = synMech
+                    synMechs.append(synMech)
+
+            sec['synMechs'] = synMechs
+
+        # Retarget NetCons, after which the redundant point processes have no references left
+        for conn in cell.conns:
+            netcon = conn.get('hObj')
+            if netcon is None or netcon.syn() is None:
+                continue
+            target = replacements.get(netcon.syn().hname())
+            if target is not None:
+                netcon.setpost(target)
+
+        num_removed += len(replacements)
+
+    return num_removed
+
+
+def synMechParameters(mod):
+    ''' Return names of the RANGE PARAMETERs of a point process mechanism (settable per instance) '''
+    from neuron import h
+
+    params = h.MechanismStandard(mod, 1)    # 1: PARAMETER variables
+    name = h.ref('')
+    names = []
+    for i in range(int(params.count())):
+        params.name(name, i)
+        names.append(name[0])
+
+    return names
+
+
+def updateSynapses(changes, reinit=True):
+    ''' Update synaptic parameters of the built network in place (no rebuild)
+
+        changes maps labels to dictionaries of param -> value, e.g.,
+            {'AMPA_3' : {'g' : 1e-3}, 'NMDA_1' : {'tau' : 100.}, 'FF_E_L23_RS_PYR->L4_RS_STEL' : {'delay' : 1.}}
+        - synMechParams label: 'g' scales the NetCon weights of the connections using that (canonical)
+          mechanism by g/(g at build), 'weight' sets their NetCon weights; other params must be
+          PARAMETERs of its mod and are set on every point process of that label
+        - connParams label: 'weight' and/or 'delay' of every NetCon of that pathway ('label' of cell.conns)
+        NOTE: 'g' of synMechParams is not a PARAMETER (ampa.mod, traub_nmda.mod assign it, gabaa.mod
+              integrates it), the conductance is carried by the NetCon weights. Weights are always
+              computed from the built (or last set) weight of each NetCon, so scans do not compound.
+              E pathways carry AMPA and NMDA on one connParams label, so scale them by synMech label.
+        Delays below netParams minDelay are rejected and the spike exchange interval is recomputed.
+        netParams (sim.net.params) is updated as well. If reinit, recorded spikes are cleared and
+        the model is re-initialized so the next sim.simulate() starts from the updated network.
+        Returns number of point processes and NetCons updated on this rank.
+    '''
+    from neuron import h
+    from netpyne import sim
+
+    synMechParams = sim.net.params.synMechParams
+    connParams = sim.net.params.connParams
+    synMechChanges = dict((label, params) for label, params in changes.items() if label in synMechParams)
+    connChanges = dict((label, params) for label, params in changes.items() if label not in synMechParams)
+
+    for label, params in synMechChanges.items():
+        allowed = [param for param in synMechParameters(synMechParams[label]['mod']) if param not in ['g', 'weight']]
+        unknown = [param for param in params if param not in ['g', 'weight'] + allowed]
+        if unknown:
+            raise Exception, 'ONLY g, weight AND PARAMETERs ' + str(allowed) + ' OF SYNAPTIC MECHANISMS CAN BE UPDATED: ' + label + ' ' + str(unknown)
+        if 'g' in params and not _builtConductances.get(label, synMechParams[label].get('g')):
+            raise Exception, 'NO g AT BUILD TO SCALE NetCon WEIGHTS FROM: ' + label
+
+    for label, params in connChanges.items():
+        if label not in connParams:
+            raise Exception, 'NO SYNAPTIC MECHANISM OR CONNECTION LABELED ' + label
+        unknown = [param for param in params if param not in ['weight', 'delay']]
+        if unknown:
+            raise Exception, 'ONLY weight AND delay OF CONNECTIONS CAN BE UPDATED: ' + label + ' ' + str(unknown)
+        if 'delay' in params and params['delay'] < sim.net.params.minDelay:
+            raise Exception, 'DELAY BELOW minDelay (%g ms): %s %g' % (sim.net.params.minDelay, label, params['delay'])
+
+    # Keep netParams consistent with the network (e.g., for saving), NetCon weights scale from the built g
+    for label, params in synMechChanges.items():
+        if 'g' in params:
+            _builtConductances.setdefault(label, synMechParams[label]['g'])
+        synMechParams[label].update((param, value) for param, value in params.items() if param != 'weight')
+    for label, params in connChanges.items():
+        connParams[label].update(params)
+
+    mechChanges = dict((label, dict((param, value) for param, value in params.items() if param not in ['g', 'weight']))
+                       for label, params in synMechChanges.items())
+    weightChanges = dict((label, params) for label, params in synMechChanges.items() if 'g' in params or 'weight' in params)
+
+    num_updated = 0
+    for cell in sim.net.cells:
+        if any(mechChanges.values()):
+            for sec in cell.secs.values():
+                for synMech in sec.get('synMechs', []):
+                    params = mechChanges.get(synMech['label'])
+                    if not params:
+                        continue
+                    for param, value in params.items():
+                        setattr(synMech['hObj'], param, value)
+                        synMech[param] = value
+                    num_updated += 1
+
+        if connChanges or weightChanges:
+            for conn in cell.conns:
+                params = connChanges.get(conn.get('label'), {})
+                synParams = weightChanges.get(conn.get('synMech'), {})
+                if not (params or synParams) or conn.get('hObj') is None:
+                    continue
+
+                if 'weight' in params or synParams:
+                    conn.setdefault('baseWeight', conn['hObj'].weight[0])
+                    if 'weight' in params:
+                        conn['baseWeight'] = params['weight']
+                    if 'weight' in synParams:
+                        conn['baseWeight'] = synParams['weight']
+                    synLabel = conn.get('synMech')
+                    scale = synMechParams[synLabel]['g']/_builtConductances[synLabel] if synLabel in _builtConductances else 1.
+                    conn['hObj'].weight[0] = conn['weight'] = conn['baseWeight']*scale
+                if 'delay' in params:
+                    conn['hObj'].delay = conn['delay'] = params['delay']
+                num_updated += 1
+
+    # Exchange interval (minimum delay between ranks) may have changed
+    if any('delay' in params for params in connChanges.values()):
+        sim.pc.set_maxstep(10)
+
+    if reinit:
+        for name in ['spkt', 'spkid']:
+            if name in sim.simData:
+                sim.simData[name].resize(0)
+        h.finitialize(sim.cfg.hParams['v_init'])
+
+    return num_updated
@@ -0,0 +1,207 @@
+'''
+    TCModel_Parallel.py contains the MPI and multithreading support of TCModel_Run.py:
+    cost-weighted assignment of cells to ranks (instead of netpyne's round-robin) and to
+    threads of a rank, and load imbalance reports.
+
+    Run in parallel with, e.g.,
+        mpiexec -n 4 python TCModel_Run.py
+    and/or set SimulationConfigs.nthreads for threads within each process (requires the
+    THREADSAFE mechanisms of mod/).
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+from collections import OrderedDict as ODict
+import heapq
+import numpy as np
+import os
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def initMPI():
+    ''' Initialize MPI in NEURON if launched by an MPI launcher (must precede ParallelContext creation) '''
+    from neuron import h
+
+    launched = any(var in os.environ for var in ['OMPI_COMM_WORLD_SIZE', 'PMI_SIZE', 'PMIX_RANK', 'SLURM_PROCID'])
+    if launched and hasattr(h, 'nrnmpi_init'):
+        h.nrnmpi_init()
+
+    return launched
+
+
+def popCellCosts(netParams):
+    ''' Return dictionary of estimated integration cost of one cell per population
+
+        Cost = sum over sections of nseg*(1 + number of density mechanisms)
+               + number of incoming synaptic point processes (from connParams)
+        i.e., roughly the number of mechanism instances integrated each timestep.
+    '''
+    costs = {}
+    for pop, popParam in netParams.popParams.items():
+        cost = 0.
+        for cellRule in netParams.cellParams.values():
+            if cellRule.get('conds', {}).get('cellModel') != popParam['cellModel']:
+                continue
+            for sec in cellRule['secs'].values():
+                nseg = sec.get('geom', {}).get('nseg', 1)
+                cost += nseg*(1 + len(sec.get('mechs', {})))
+            break
+
+        for connParam in netParams.connParams.values():
+            if connParam.get('postConds', {}).get('pop') != pop:
+                continue
+            synMechs = connParam.get('synMech')
+            numSynMechs = len(synMechs) if isinstance(synMechs, list) else 1
+            cost += (connParam.get('numPreToPost') or 0)*numSynMechs*(connParam.get('synsPerConn') or 1)
+
+        costs[pop] = cost
+
+    return costs
+
+
+def balanceCells(popSizes, popCosts, nhosts):
+    ''' Assign cells to ranks with the longest-processing-time greedy rule
+
+        Cells are taken in order of decreasing cost and each is given to the currently least
+        loaded rank. Returns (hostCells, hostLoads): hostCells[pop][rank] lists the cell indices
+        (within pop) of each rank, as returned by netpyne's Pop._distributeCells().
+    '''
+    cells = [(-popCosts[pop], pop, i) for pop, size in popSizes.items() for i in range(size)]
+    cells.sort()
+
+    loads = [(0., rank) for rank in range(nhosts)]
+    hostCells = dict((pop, dict((rank, []) for rank in range(nhosts))) for pop in popSizes)
+    for negCost, pop, i in cells:
+        load, rank = heapq.heappop(loads)
+        hostCells[pop][rank].append(i)
+        heapq.heappush(loads, (load - negCost, rank))
+
+    for pop in hostCells:
+        for rank in hostCells[pop]:
+            hostCells[pop][rank].sort()
+
+    hostLoads = np.zeros(nhosts)
+    for load, rank in loads:
+        hostLoads[rank] = load
+
+    return hostCells, hostLoads
+
+
+def roundRobinLoads(popSizes, popCosts, nhosts):
+    ''' Return per rank load of netpyne's round-robin assignment (continues across populations) '''
+    hostLoads = np.zeros(nhosts)
+    nextHost = 0
+    for pop, size in popSizes.items():
+        for i in range(size):
+            hostLoads[nextHost] += popCosts[pop]
+            nextHost = (nextHost + 1) % nhosts
+
+    return hostLoads
+
+
+def loadImbalance(hostLoads):
+    ''' Return max/mean load over ranks (1 is perfect balance) '''
+    return np.max(hostLoads)/np.mean(hostLoads) if np.mean(hostLoads) > 0 else 1.
+
+
+def applyLoadBalance(popCosts):
+    ''' Replace netpyne's round-robin cell distribution with balanceCells()
+
+        popCosts is the output of popCellCosts(). Must be called after sim.net.createPops()
+        and before sim.net.createCells(). Returns hostLoads (estimated cost per rank).
+    '''
+    from netpyne import sim
+
+    popSizes = ODict((pop, int(popObj.tags['numCells'])) for pop, popObj in sim.net.pops.items())
+    hostCells, hostLoads = balanceCells(popSizes, popCosts, sim.nhosts)
+
+    for pop, popObj in sim.net.pops.items():
+        # Instance attribute shadows Pop._distributeCells() used by createCellsFixedNum()
+        popObj._distributeCells = lambda numCellsPop, cells=hostCells[pop]: cells
+
+    if sim.rank == 0:
+        rrLoads = roundRobinLoads(popSizes, popCosts, sim.nhosts)
+        print '\nLoad balance over %d ranks (max/mean cost): %.3f (round-robin: %.3f)' % (
+                    sim.nhosts, loadImbalance(hostLoads), loadImbalance(rrLoads))
+        for rank, load in enumerate(hostLoads):
+            print '  rank %d: estimated cost %.0f' % (rank, load)
+
+    return hostLoads
+
+
+def rootSection(cell):
+    ''' Return root section (hoc object) of a netpyne cell '''
+    from neuron import h
+
+    sec = next(iter(cell.secs.values()))['hObj']
+
+    return h.SectionRef(sec=sec).root
+
+
+def partitionThreads(nthreads, popCosts):
+    ''' Run local cells in nthreads threads, assigned to threads with balanceCells()
+
+        popCosts is the output of popCellCosts(). Must be called after the network is created
+        and before the simulation is initialized. Returns threadLoads (estimated cost per thread).
+    '''
+    from neuron import h
+    from netpyne import sim
+
+    sim.pc.nthread(nthreads, 1)
+
+    localCells = ODict((pop, [cell for cell in sim.net.cells if cell.tags['pop'] == pop]) for pop in sim.net.pops)
+    popSizes = ODict((pop, len(cells)) for pop, cells in localCells.items())
+    threadCells, threadLoads = balanceCells(popSizes, popCosts, nthreads)
+
+    if nthreads > 1:
+        for ithread in range(nthreads):
+            sl = h.SectionList()
+            for pop, cells in localCells.items():
+                for i in threadCells[pop][ithread]:
+                    sl.append(sec=rootSection(cells[i]))
+            sim.pc.partition(ithread, sl)
+
+    if sim.rank == 0:
+        print '\nThreads per rank: %d (estimated max/mean cost on rank 0: %.3f)' % (nthreads, loadImbalance(threadLoads))
+
+    return threadLoads
+
+
+def reportExchangeInterval():
+    ''' Return interval (ms) between spike exchanges of ranks, i.e., the minimum NetCon delay between cells
+
+        Must be called after connections are created. Prints the interval and the number of
+        integration steps per exchange on rank 0.
+    '''
+    from netpyne import sim
+
+    interval = sim.pc.set_maxstep(10)
+
+    if sim.rank == 0:
+        print '\nSpike exchange interval: %.3f ms (%d steps of dt = %g ms)' % (
+                    interval, int(round(interval/sim.cfg.dt)), sim.cfg.dt)
+        if interval < sim.cfg.dt:
+            print '  WARNING: minimum delay below dt, not supported by the parallel fixed step method (increase minDelay)'
+
+    return interval
+
+
+def reportRunImbalance():
+    ''' Gather measured integration time (excluding spike exchange waits) of every rank after a run
+
+        Returns list of ParallelContext.step_time() per rank and prints it on rank 0.
+    '''
+    from netpyne import sim
+
+    stepTimes = sim.pc.py_allgather(sim.pc.step_time())
+
+    if sim.rank == 0:
+        print '\nMeasured load balance over %d ranks (max/mean step time): %.3f' % (sim.nhosts, loadImbalance(np.array(stepTimes)))
+        for rank, stepTime in enumerate(stepTimes):
+            print '  rank %d: %.2f s' % (rank, stepTime)
+
+    return stepTimes
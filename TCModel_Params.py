@@ -22,23 +22,20 @@
 from collections import OrderedDict as ODict
 from itertools import product
 import math
-import neuron
 import numpy as np
 import os
 from os.path import join
 from GeneratedSynapseParams import *
+from TCModel_Cache import paramsCacheKey, loadCache, saveCache
 
 
 # Important paths for simulations
 path2cells = 'cells/generatedNEURON'
 
-# Compile mod files and load them
-# Uncomment 'os.system()' on first run
-# os.system('''
-#           cd mod/generatedNEURON
-#           nrnivmodl
-#           ''')
-neuron.load_mechanisms('mod/generatedNEURON/')
+# NOTE: mod files are compiled and loaded by TCModel_Build.loadMechanisms()
+
+# Memoized parameter builds (see getPopulationParams())
+_populationParams = {}
 
 
 ################################################################################
@@ -61,11 +58,22 @@ def convertIntListToCompList(list):
     return new_list
 
 
+def getPopulationParams(testing=True):
+    ''' Return PopulationParams object built once per process (for each testing flag)
+
+        Shared by the network (TCModel_Run.py) and simulation (TCModel_Config.py) configurations
+    '''
+    if testing not in _populationParams:
+        _populationParams[testing] = PopulationParams(testing)
+
+    return _populationParams[testing]
+
+
 ################################################################################
 ##### General parameters
 ################################################################################
 class GeneralParams(object):
-    def __init__(self):
+    def __init__(self, testing=True):
         ''' Class defining global domain and network parameters used in sub-classes '''
 
     ####################################
@@ -77,7 +85,7 @@ class GeneralParams(object):
     ####################################
 
         # Used as conditional flag for development (Used in *_Config file also)
-        self.testing = True
+        self.testing = testing      # True: tenth of full model size
         self.includeGJ = True
 
 
@@ -115,17 +123,27 @@ class GeneralParams(object):
 
 
 
+        # Axonal conduction delays of chemical connections (see PopulationParams.connDelay())
+        # NOTE: minDelay is the smallest NetCon delay, i.e., the interval between spike exchanges
+        #       of MPI ranks, so it must be at least dt (checked by TCModel_Run.createNetwork())
+        self.delayRule = 'fixed'        # 'fixed', 'distance' or 'lengthConst'
+        self.minDelay = 0.5             # minimum axonal delay (ms)
+
         # MISC (NOTE: if adding additional spatial features - remember to add keyargs to neParamsDict)
-        # self.propVelocity = 100.0      # propagation velocity (um/ms)
-        # self.probLengthConst = 150.0   # length constant for conn probability (um)
+        self.propVelocity = 100.0      # propagation velocity (um/ms)
+        self.probLengthConst = 150.0   # length constant for conn probability (um)
 
 
         # Parent dictionary for specs.NetParams() class (Doesn't include everything)
+        # NOTE: minDelay, propVelocity and probLengthConst are referenced by name in delay string functions
         self.netParamsDict = {
                 'shape' : self.shape,
                 'sizeX' : self.sizeX,
                 'sizeY' : self.sizeY,
                 'sizeZ' : self.sizeZ,
+                'minDelay' : self.minDelay,
+                'propVelocity' : self.propVelocity,
+                'probLengthConst' : self.probLengthConst,
         }
 
 
@@ -134,11 +152,11 @@ class GeneralParams(object):
 ##### Network parameters
 ################################################################################
 class NetworkParams(GeneralParams):
-    def __init__(self):
+    def __init__(self, testing=True):
         ''' Class defining network-level model parameters '''
 
         # Inherit parent class params
-        GeneralParams.__init__(self)
+        GeneralParams.__init__(self, testing)
 
     ####################################
     #                                  #
@@ -313,11 +331,33 @@ class NetworkParams(GeneralParams):
 ##### Population parameters
 ################################################################################
 class PopulationParams(NetworkParams):
-    def __init__(self):
-        ''' Class defining population-level model parameters - used by specs.NetParams() from netpyne '''
+
+    # Multipliers of the GeneratedSynapseParams conductances (g_syn) giving synMechParams 'g' in _Y_describeSyn()
+    # NOTE: the mods do not read 'g' (NetCon weights carry the conductance), so these do not change a
+    #       simulation; scale the strengths of a built network with TCModel_Network.updateSynapses(),
+    #       e.g., {'NMDA_0' : {'g' : g}} scales the NMDA_0 NetCon weights by g relative to its 'g' at build
+    gScaleAMPA = 2.         # AMPA from principal cells
+    gScaleNMDA = 2.5        # NMDA from principal onto principal cells
+    gScaleNMDA_IN = .2      # NMDA from principal cells onto interneurons
+    gScaleGABA = 1.         # GABA_A from interneurons
+
+    def __init__(self, testing=True, useCache=True):
+        ''' Class defining population-level model parameters - used by specs.NetParams() from netpyne
+
+            If useCache, the fully built parameters are loaded from (or saved to) an on-disk
+            cache keyed by GeneratedSynapseParams, the class sources and the flags above.
+        '''
 
         # Inherit parent class params
-        NetworkParams.__init__(self)
+        NetworkParams.__init__(self, testing)
+
+        # Skip the nested population/synapse/projection loops if already built for these inputs
+        cacheKey = paramsCacheKey(self)
+        if useCache:
+            cached = loadCache('netParams', cacheKey)
+            if cached is not None:
+                self.__dict__.update(cached)
+                return
 
     ####################################
     #                                  #
@@ -357,6 +397,9 @@ class PopulationParams(NetworkParams):
                 'connParams' : self.Y_projectParams,
         })
 
+        if useCache:
+            saveCache('netParams', cacheKey, self.__dict__)
+
 
 
     ###################################
@@ -456,13 +499,15 @@ class PopulationParams(NetworkParams):
             Example parameter dictionary for run file:
             >> from netpyne import specs
             >> netParams = specs.NetParams()
-            >> netParams.synMechParams['AMPA_L23_RS_PYR_to_L23_LTS_IN'] = {
+            >> netParams.synMechParams['AMPA_0'] = {
             >>                                     'mod': 'AMPA'
             >>                                     'tau' : 1.e0,
             >>                                     'g' : 2.e-3
             >>                                   }
 
-            Keyargs are stored in 'Y_synapseMechParams'
+            Keyargs are stored in 'Y_synapseMechParams'. Labels are canonical, i.e., one per
+            distinct definition, and 'synMechLabels' maps pathway labels such as
+            'AMPA_L23_RS_PYR_to_L23_LTS_IN' to them. Pathways without connections are skipped.
 
             See http://neurosimlab.org/netpyne/index.html for more details
         '''
@@ -470,80 +515,85 @@ class PopulationParams(NetworkParams):
         # Synapse Mechanisms dictionary for NETPYNE instantiation
         Y_synapseMechParams = {}
 
-        # Synapse list for project labels
+        # Synapse list for project labels (unique canonical labels)
         self.syn_list = []
 
+        # Canonical label of each pathway's mechanism, e.g., 'AMPA_L23_RS_PYR_to_L4_RS_STEL' -> 'AMPA_3'
+        # NOTE: identical (mod, tau, g) definitions share one label, hence one set of point processes per compartment
+        self.synMechLabels = {}
+        canonLabels = {}
+        canonCounts = {}
 
-        for pops_i, _, _, ptypes_i, etypes_i, _, temps_i in self.Y_ziplist:       # presynaptic layer
-            for pops_j, _, _, ptypes_j, etypes_j, _, temps_j in self.Y_ziplist:   # postsynaptic layer
+        def addSynMech(pathway, prefix, synMech):
+            key = tuple(sorted(synMech.items()))
+            if key not in canonLabels:
+                canonCounts[prefix] = canonCounts.get(prefix, 0) + 1
+                canonLabels[key] = prefix + '_' + str(canonCounts[prefix] - 1)
+                self.syn_list.append(canonLabels[key])
+                Y_synapseMechParams.update({canonLabels[key] : synMech})
+            self.synMechLabels[pathway] = canonLabels[key]
 
-                for pop_i, ptype_i, etype_i, temp_i in zip(pops_i, ptypes_i, etypes_i, temps_i):         # presynaptic cell x
 
-                    # Gap Junctions (NOTE: all but axo-axonic interneurons)
-                    if self.includeGJ:
-                        if not ptype_i == 'AXO':
-                            label = 'GJ_' + pop_i
-                            g_id = 'gGAP_' + temp_i
+        for i, (pops_i, _, _, ptypes_i, etypes_i, _, temps_i) in enumerate(self.Y_ziplist):       # presynaptic layer
+
+            for k, (pop_i, ptype_i, etype_i, temp_i) in enumerate(zip(pops_i, ptypes_i, etypes_i, temps_i)):         # presynaptic cell x
 
-                            # Update synapse list
-                            self.syn_list.append(label)
+                # pre cell id
+                pre_id = findNumPops(self.num_layer_pops,i) + k
 
-                            Y_synapseMechParams.update({label : {'mod' : self.mod_list[3],
-                                                                 'g' : g_gap[g_id]
-                                                                }
+                # Gap Junctions (NOTE: all but axo-axonic interneurons + once per population)
+                if self.includeGJ:
+                    if not ptype_i == 'AXO':
+                        g_id = 'gGAP_' + temp_i
+
+                        addSynMech('GJ_' + pop_i, 'GJ', {'mod' : self.mod_list[3],
+                                                         'g' : g_gap[g_id]
                                                         })
 
-                    for pop_j, ptype_j, etype_j, temp_j in zip(pops_j, ptypes_j, etypes_j, temps_j):     # postsynaptic cell
+                for j, (pops_j, _, _, ptypes_j, etypes_j, _, temps_j) in enumerate(self.Y_ziplist):   # postsynaptic layer
+                    for l, (pop_j, ptype_j, etype_j, temp_j) in enumerate(zip(pops_j, ptypes_j, etypes_j, temps_j)):     # postsynaptic cell
 
+                        # post cell id
+                        post_id = findNumPops(self.num_layer_pops,j) + l
+
+                        # Never emit mechanisms for pathways without connections
+                        if not self.num_conns[pre_id][post_id] > 0:
+                            continue
 
                         if ptype_i in ['PYR','STEL']:
                             # AMPARs
-                            label1 = 'AMPA_' + pop_i + '_to_' + pop_j
                             var_id1 = 'AMPA_' + temp_i + '_to_' + temp_j
                             tau_id1 = 'tau' + var_id1
                             g_id1 = 'g' + var_id1
 
-                            # Update synapse list
-                            self.syn_list.append(label1)
-
                             # NMDARs
-                            label2 = 'NMDA_' + pop_i + '_to_' + pop_j
                             var_id2 = 'NMDA_' + temp_i + '_to_' + temp_j
                             tau_id2 = 'tau' + var_id2
                             g_id2 = 'g' + var_id2
 
-                            # Update synapse list
-                            self.syn_list.append(label2)
-
                             if tau_id1 in tau_syn: # Check if in SynapseParams
-                                Y_synapseMechParams.update({label1 : {'mod' : self.mod_list[0], # AMPA
-                                                                      'tau' : tau_syn[tau_id1],
-                                                                      'g' : g_syn[g_id1]*2,# if ptype_i == 'PYR' else g_syn[g_id1],
-                                                                      },
-                                                            label2 : {'mod' : self.mod_list[1], # NMDA
-                                                                      'tau' : tau_syn[tau_id2],
-                                                                      'g' : g_syn[g_id2]*.2 if ptype_j in ['BASK','AXO','IN'] else g_syn[g_id2]*2.5,
-                                                                      }
-                                                            })
+                                addSynMech('AMPA_' + pop_i + '_to_' + pop_j, 'AMPA', {'mod' : self.mod_list[0], # AMPA
+                                                                                      'tau' : tau_syn[tau_id1],
+                                                                                      'g' : g_syn[g_id1]*self.gScaleAMPA,
+                                                                                      })
+                                addSynMech('NMDA_' + pop_i + '_to_' + pop_j, 'NMDA', {'mod' : self.mod_list[1], # NMDA
+                                                                                      'tau' : tau_syn[tau_id2],
+                                                                                      'g' : g_syn[g_id2]*(self.gScaleNMDA_IN if ptype_j in ['BASK','AXO','IN'] else self.gScaleNMDA),
+                                                                                      })
                             else:
                                 continue
 
                         if ptype_i in ['BASK', 'AXO', 'IN']:
                             # GABARs
-                            label = 'GABA_' + pop_i + '_to_' + pop_j
                             var_id = 'GABA_' + temp_i + '_to_' + temp_j
                             tau_id = 'tau' + var_id
                             g_id = 'g' + var_id
 
-                            # update synapse list
-                            self.syn_list.append(label)
-
                             if tau_id in tau_syn:   # Check if in SynapseConfig
-                                Y_synapseMechParams.update({label : {'mod' : self.mod_list[2],
-                                                                    'tau' : tau_syn[tau_id],
-                                                                    'g' : g_syn[g_id]
-                                                                    }
-                                                            })
+                                addSynMech('GABA_' + pop_i + '_to_' + pop_j, 'GABA', {'mod' : self.mod_list[2],
+                                                                                      'tau' : tau_syn[tau_id],
+                                                                                      'g' : g_syn[g_id]*self.gScaleGABA
+                                                                                      })
                             else:
                                 continue
 
@@ -590,6 +640,25 @@ class PopulationParams(NetworkParams):
 
         return Y_importParams
 
+    def connDelay(self):
+        ''' Return 'delay' of chemical connParams entries for the delay rule (self.delayRule)
+
+            - 'fixed' : minDelay everywhere
+            - 'distance' : minDelay + conduction time at propVelocity
+            - 'lengthConst' : minDelay + 6*exp(-dist_3D/probLengthConst) (former commented special case)
+
+            Distance rules are string functions evaluated per connection by netpyne (or by
+            TCModel_Connectivity.pathwayDelays()), with variables taken from netParams.
+        '''
+        if self.delayRule == 'fixed':
+            return self.minDelay
+        elif self.delayRule == 'distance':
+            return 'minDelay + dist_3D/propVelocity'
+        elif self.delayRule == 'lengthConst':
+            return 'minDelay + 6*exp(-dist_3D/probLengthConst)'
+        else:
+            raise Exception, 'UNKNOWN DELAY RULE: ' + str(self.delayRule)
+
     def _Y_project(self):
         ''' Return nested parameter dictionary for NETPYNE connection parameters
 
@@ -623,6 +692,8 @@ class PopulationParams(NetworkParams):
 
         Y_projectParams = {}
 
+        # Same delay (value or string function) for every chemical pathway
+        delay = self.connDelay()
 
         # Create data structure
         for i, (pops_i, _, _, ptypes_i, etypes_i, _, temps_i) in enumerate(self.Y_ziplist):       # presynaptic layer
@@ -645,7 +716,7 @@ class PopulationParams(NetworkParams):
 
                             Y_projectParams.update({ gjtype : {
                                     'preConds' : {'pop' : pop_i}, 'postConds' : {'pop' : pop_i},
-                                    'synMech' : 'GJ_' + pop_i,
+                                    'synMech' : self.synMechLabels['GJ_' + pop_i],
                                     'connFunc' : 'traubCellConn',
                                     'numPreToPost' : self.num_conns[pre_id][pre_id],
                                     'synsPerConn' : num_gj if num_gj>1 else None,
@@ -698,9 +769,10 @@ class PopulationParams(NetworkParams):
                                     'preConds': {'pop': pop_i}, 'postConds': {'pop': pop_j},
                                     'connFunc' : 'traubCellConn',
                                     'numPreToPost' : self.num_conns[pre_id][post_id],
-                                    'delay': 0,             # ignore axonal conduction delays within column (NOTE: defaults to 1 if omitted)
+                                    'delay': delay,         # axonal conduction delay (NOTE: defaults to 1 if omitted)
                                     'sec': secs,
-                                    'synMech' : ['AMPA_' + pop_i + '_to_' + pop_j, 'NMDA_' + pop_i + '_to_' + pop_j],       # makes 2 synapses per sec
+                                    'synMech' : [self.synMechLabels['AMPA_' + pop_i + '_to_' + pop_j],
+                                                 self.synMechLabels['NMDA_' + pop_i + '_to_' + pop_j]],       # makes 2 synapses per sec
                                     }
                                 })
 
@@ -721,9 +793,9 @@ class PopulationParams(NetworkParams):
                                     'connFunc' : 'traubCellConn',
                                     'numPreToPost' : self.num_conns[pre_id][post_id],
                                     'weight' : None, # TODO: Temporary fix to NETPYNE error not defaulting to None
-                                    'delay': 0,         # ignore axonal conduction delays within column (NOTE: defaults to 1 if omitted)
+                                    'delay': delay,     # axonal conduction delay (NOTE: defaults to 1 if omitted)
                                     'sec': secs,
-                                    'synMech' : 'GABA_' + pop_i + '_to_' + pop_j,
+                                    'synMech' : self.synMechLabels['GABA_' + pop_i + '_to_' + pop_j],
                                     }
                                 })
 
@@ -733,9 +805,9 @@ class PopulationParams(NetworkParams):
                         ###################################
                         # NOTE: Update special cases as needed. Easier to do statically than with if-elif-else conditionals
 
-                        # Special case 1
+                        # Special case 1 (see connDelay() for the delay rules of all pathways)
                         # if conntype == 'recurrent_E_L23_RS_PYR':
-                        #     Y_projectParams['recurrent_E_L23_PYR_RS']['delay'] = '6*exp(-dist_3D/probLengthConst)'
+                        #     Y_projectParams['recurrent_E_L23_PYR_RS']['delay'] = 'minDelay + 6*exp(-dist_3D/probLengthConst)'
 
 
         return Y_projectParams
@@ -0,0 +1,235 @@
+'''
+    TCModel_Rest.py equilibrates every cell template in isolation and caches its resting state
+    (membrane potential, gating variables and ion concentrations of every segment) so that
+    cells can start from rest instead of a random potential (SimulationConfigs.initMode).
+
+    Each template is instantiated alone (no synapses or stimulation) in a separate process,
+    so the isolated cell never becomes part of a network, and simulated until no potential
+    changes by more than tolerance over checkInterval. The state is cached under a key of the
+    template, the mechanism library, dt and hParams. At initialization (after the INITIAL
+    blocks) every cell is set to the state of its template, with its membrane potential
+    shifted by a normally distributed offset per cell (SimulationConfigs.restJitter).
+
+    Usage (precompute the states of all templates, e.g., before a batch):
+        python TCModel_Rest.py
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import json
+import numpy as np
+from os.path import join, abspath
+import subprocess
+import sys
+import TCModel_Cache
+
+
+# Isolated simulation: maximum duration, interval and tolerance of the steady state check (ms, mV)
+maxDuration = 5000.
+checkInterval = 100.
+tolerance = 0.01
+
+# FInitializeHandler objects setting the resting states (must live as long as the network)
+_initHandlers = []
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def densityMechanisms():
+    ''' Return names of all density mechanisms (including ions) known to NEURON '''
+    from neuron import h
+
+    names = []
+    name = h.ref('')
+    mechTypes = h.MechanismType(0)
+    for i in range(int(mechTypes.count())):
+        mechTypes.select(i)
+        mechTypes.selected(name)
+        names.append(name[0])
+
+    return names
+
+
+def stateVariables(sec, mechanisms):
+    ''' Return names of the range variables defining the state of a section
+
+        Membrane potential, STATE variables of the inserted mechanisms and inner and outer
+        concentrations of the ions used.
+    '''
+    from neuron import h
+
+    names = ['v']
+    for mech in mechanisms:
+        if not h.ismembrane(mech, sec=sec):
+            continue
+        if mech.endswith('_ion'):
+            ion = mech[:-len('_ion')]
+            names += [ion + 'i', ion + 'o']
+        else:
+            states = h.MechanismStandard(mech, 3)   # 3: STATE variables
+            name = h.ref('')
+            for i in range(int(states.count())):
+                states.name(name, i)
+                names.append(name[0])
+
+    return names
+
+
+def cellState(secs, mechanisms):
+    ''' Return {section label: {variable: per segment values}} for a list of (label, section) '''
+    state = {}
+    for label, sec in secs:
+        state[label] = dict((var, [getattr(seg, var) for seg in sec]) for var in stateVariables(sec, mechanisms))
+
+    return state
+
+
+def setCellState(secs, state, vOffset=0.):
+    ''' Set sections of a list of (label, section) to state (see cellState()), shifting v by vOffset '''
+    for label, sec in secs:
+        for var, values in state.get(label, {}).items():
+            offset = vOffset if var == 'v' else 0.
+            for seg, value in zip(sec, values):
+                setattr(seg, var, value + offset)
+
+
+def restCacheKey(importDict, hParams, dt):
+    ''' Return key of the resting state of the template of importDict (mechanisms must be loaded) '''
+    import TCModel_Build
+
+    digest = TCModel_Cache.hashFiles([importDict['fileName'], join(TCModel_Build.mechanismsDir(), 'manifest.json')])
+    TCModel_Cache.hashObject([importDict['fileName'], importDict['cellName']], digest)
+    TCModel_Cache.hashObject([hParams, dt, maxDuration, checkInterval, tolerance], digest)
+
+    return digest.hexdigest()
+
+
+def equilibrateTemplate(fileName, cellName, hParams, dt):
+    ''' Simulate one cell of a template alone until it is at rest and return (state, time, converged) '''
+    from neuron import h
+
+    h.load_file(fileName)
+    cell = getattr(h, cellName)()
+    secs = [(sec.name().split('.')[-1], sec) for sec in cell.all]
+    mechanisms = densityMechanisms()
+
+    if 'celsius' in hParams:
+        h.celsius = hParams['celsius']
+    h.dt = dt
+    h.finitialize(hParams.get('v_init', -65.))
+
+    converged = False
+    numSteps = int(round(checkInterval/dt))
+    vPrev = np.array([seg.v for _, sec in secs for seg in sec])
+    while h.t < maxDuration and not converged:
+        for _ in range(numSteps):
+            h.fadvance()
+        v = np.array([seg.v for _, sec in secs for seg in sec])
+        converged = np.abs(v - vPrev).max() < tolerance
+        vPrev = v
+
+    return cellState(secs, mechanisms), h.t, converged
+
+
+def templateImports(fullParams):
+    ''' Return {cellModel: import dictionary} with one entry per template of fullParams '''
+    imports = {}
+    for importDict in fullParams.Y_importParams.values():
+        imports[importDict['conds']['cellModel']] = importDict
+
+    return imports
+
+
+def getRestingStates(fullParams, hParams, dt, useCache=True):
+    ''' Return {cellModel: resting state} for all templates of fullParams
+
+        Missing states are computed in parallel child processes (only by rank 0 with MPI).
+        Mechanisms must be loaded (e.g., by TCModel_Run.buildNetParams()).
+    '''
+    from neuron import h
+    import TCModel_Build
+
+    imports = templateImports(fullParams)
+    keys = dict((cellModel, restCacheKey(importDict, hParams, dt)) for cellModel, importDict in imports.items())
+
+    pc = h.ParallelContext()
+    if int(pc.id()) == 0:
+        selfFile = abspath(TCModel_Cache.sourceFile(sys.modules[__name__]))
+        missing = [cellModel for cellModel in sorted(imports)
+                   if not useCache or TCModel_Cache.loadCache('rest', keys[cellModel]) is None]
+        children = []
+        for cellModel in missing:
+            importDict = imports[cellModel]
+            spec = json.dumps({'fileName' : importDict['fileName'], 'cellName' : importDict['cellName'],
+                               'hParams' : hParams, 'dt' : dt, 'mechDir' : TCModel_Build.mechanismsDir(),
+                               'key' : keys[cellModel]})
+            children.append((cellModel, subprocess.Popen([sys.executable, selfFile, '--template', spec])))
+
+        for cellModel, child in children:
+            if child.wait() != 0:
+                raise Exception, 'EQUILIBRATION OF %s FAILED' % cellModel
+    pc.barrier()
+
+    states = {}
+    for cellModel in imports:
+        rest = TCModel_Cache.loadCache('rest', keys[cellModel])
+        if not rest['converged'] and int(pc.id()) == 0:
+            print 'WARNING: %s not at rest after %.0f ms (spontaneously active?), using its last state' % (cellModel, rest['t'])
+        states[cellModel] = rest['state']
+
+    return states
+
+
+def applyRestingStates(states, jitter=0., seed=1):
+    ''' Initialize every local cell to the resting state of its template (see getRestingStates())
+
+        Every cell's membrane potential is shifted by a normal offset with standard deviation
+        jitter (mV), drawn from a stream of (seed, gid), i.e., independent of the number of ranks.
+        Must be called after sim.net.createCells(). Returns number of cells set.
+    '''
+    from neuron import h
+    from netpyne import sim
+
+    cells = []
+    for cell in sim.net.cells:
+        state = states.get(cell.tags.get('cellModel'))
+        if state is None:
+            continue
+        offset = np.random.RandomState([seed, cell.gid]).normal(0., jitter) if jitter > 0 else 0.
+        cells.append(([(label, sec['hObj']) for label, sec in cell.secs.items()], state, offset))
+
+    def initStates():
+        for secs, state, offset in cells:
+            setCellState(secs, state, offset)
+
+    _initHandlers.append(h.FInitializeHandler(1, initStates))    # 1: after INITIAL blocks
+
+    return len(cells)
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 2 and sys.argv[1] == '--template':
+        import neuron
+
+        # Child process of getRestingStates(): one template in isolation
+        spec = json.loads(sys.argv[2])
+        neuron.load_mechanisms(spec['mechDir'])
+        state, t, converged = equilibrateTemplate(str(spec['fileName']), str(spec['cellName']), spec['hParams'], spec['dt'])
+        TCModel_Cache.saveCache('rest', spec['key'], {'state' : state, 't' : t, 'converged' : converged})
+        sys.exit(0)
+
+    from netpyne import specs
+    from TCModel_Config import ModelConfigs
+    from TCModel_Build import loadMechanisms
+
+    fullConfigs = ModelConfigs()
+    simConfig = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
+    loadMechanisms(fullConfigs.params)
+
+    states = getRestingStates(fullConfigs.params, dict(simConfig.hParams), simConfig.dt)
+    print '\nResting states of %d templates cached in %s' % (len(states), TCModel_Cache.path2cache)
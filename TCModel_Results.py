@@ -0,0 +1,276 @@
+'''
+    TCModel_Results.py writes the results of a run as separate stores next to its output
+    (SimulationConfigs.saveStores) and opens them lazily for analysis of finished runs.
+
+    Stores of a run with simConfig filename <prefix>:
+        <prefix>_spikes/        columnar spikes with population and time index (TCModel_Spikes)
+        <prefix>_conns/         connections as .npy columns sorted by postsynaptic gid, with
+                                per cell offsets (conns onto gid g: [offsets[g], offsets[g + 1]))
+        <prefix>_traces/        recorded traces as (cells x samples) float32 .npy per trace and
+                                their sample times (t.npy), or
+        <prefix>_traces_<r>.h5  traces streamed during the run by rank r (TCModel_Traces)
+        <prefix>_params.pkl     netParams and simConfig
+
+    RunResults opens nothing until a store is first accessed. Spikes, connections and traces
+    are memory-mapped (HDF5 traces are read by slice), so selecting cells, populations or time
+    windows only reads the selected data.
+
+    Example usage:
+        >> results = RunResults('output/dat/TC_output')
+        >> times, gids = results.spikes.spikes('L23_RS_PYR', [200, 400])
+        >> v = results.traces('Somatic Potential (mv)', pop='L5_IB_PYR', timeRange=[200, 400])
+        >> conns = results.conns.cellConns(results.popGids('L4_RS_STEL'))
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import cPickle as pickle
+from glob import glob
+import json
+import numpy as np
+import os
+from os.path import join, dirname, exists, isdir
+from TCModel_Spikes import SpikeFile
+
+
+# Columns of the connection store (non-cell sources, e.g., NetStims, have preGid -1)
+connColumns = [('preGids', np.int32), ('postGids', np.int32), ('weights', np.float32), ('delays', np.float32),
+               ('synMechs', np.int16), ('secs', np.int16), ('locs', np.float32)]
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def saveColumns(dirName, columns, index):
+    ''' Write dictionary of arrays as .npy files and index (JSON) to dirName '''
+    if not exists(dirName):
+        os.makedirs(dirName)
+
+    for name, array in columns.items():
+        np.save(join(dirName, name + '.npy'), array)
+    with open(join(dirName, 'index.json'), 'w') as fileObj:
+        json.dump(index, fileObj, indent=1)
+
+    return dirName
+
+
+def saveConns(dirName, cells, numCells):
+    ''' Write connections of a list of (gathered) netpyne cells as columns sorted by postsynaptic gid '''
+    synMechs, secs = [], []
+    rows = dict((name, []) for name, _ in connColumns)
+
+    for cell in cells:
+        for conn in cell['conns']:
+            if conn.get('synMech') not in synMechs:
+                synMechs.append(conn.get('synMech'))
+            if conn.get('sec') not in secs:
+                secs.append(conn.get('sec'))
+            weight, delay = conn.get('weight', 0.), conn.get('delay', 0.)
+
+            rows['preGids'].append(conn['preGid'] if isinstance(conn['preGid'], (int, long)) else -1)
+            rows['postGids'].append(cell['gid'])
+            rows['weights'].append(weight[0] if isinstance(weight, list) else weight)
+            rows['delays'].append(delay[0] if isinstance(delay, list) else delay)
+            rows['synMechs'].append(synMechs.index(conn.get('synMech')))
+            rows['secs'].append(secs.index(conn.get('sec')))
+            rows['locs'].append(conn.get('loc', 0.5))
+
+    columns = dict((name, np.array(rows[name], dtype=dtype)) for name, dtype in connColumns)
+    order = np.argsort(columns['postGids'], kind='mergesort')
+    for name in columns:
+        columns[name] = columns[name][order]
+    columns['offsets'] = np.searchsorted(columns['postGids'], np.arange(numCells + 1)).astype(np.int64)
+
+    return saveColumns(dirName, columns, {'synMechs' : synMechs, 'secs' : secs})
+
+
+def saveTraces(dirName, simData, recordTraces, recordStep):
+    ''' Write gathered traces (simData[trace]['cell_<gid>']) as (cells x samples) float32 arrays
+
+        The sample times (simData['t']) are saved as well, as they do not start at 0 in steps of
+        recordStep for runs restored from an equilibrated state (TCModel_State).
+    '''
+    columns, traces = {}, []
+    for i, traceName in enumerate(sorted(recordTraces)):
+        cellTraces = simData.get(traceName, {})
+        gids = sorted(int(cellKey.split('_')[-1]) for cellKey in cellTraces)
+        if not gids:
+            continue
+        numSamples = min(len(cellTraces['cell_%d' % gid]) for gid in gids)
+        columns['trace_%d' % i] = np.array([np.asarray(cellTraces['cell_%d' % gid])[:numSamples] for gid in gids], dtype=np.float32)
+        traces.append({'name' : traceName, 'file' : 'trace_%d' % i, 'gids' : gids})
+
+    if 't' in simData:
+        columns['t'] = np.asarray(simData['t'], dtype=np.float64)
+
+    return saveColumns(dirName, columns, {'traces' : traces, 'recordStep' : recordStep, 'times' : 't' in columns})
+
+
+def saveRunStores(prefix, streamedTraces=False):
+    ''' Write params, connections and (unless streamed) traces of the finished run on rank 0 '''
+    from netpyne import sim
+
+    if sim.rank != 0:
+        return
+
+    if dirname(prefix) and not exists(dirname(prefix)):
+        os.makedirs(dirname(prefix))
+
+    with open(prefix + '_params.pkl', 'wb') as fileObj:
+        pickle.dump({'netParams' : dict((key, value) for key, value in sim.net.params.__dict__.items() if not key.startswith('_')),
+                     'simConfig' : dict(sim.cfg.__dict__)}, fileObj, pickle.HIGHEST_PROTOCOL)
+
+    if sim.net.allCells:
+        saveConns(prefix + '_conns', sim.net.allCells, sum(int(popParam['numCells']) for popParam in sim.net.params.popParams.values()))
+
+    if not streamedTraces and sim.cfg.recordTraces:
+        saveTraces(prefix + '_traces', sim.allSimData, sim.cfg.recordTraces, sim.cfg.recordStep)
+
+
+
+################################################################################
+#### Class declarations
+################################################################################
+class ConnStore(object):
+    def __init__(self, dirName):
+        ''' Memory-mapped connections written by saveConns() '''
+        with open(join(dirName, 'index.json')) as fileObj:
+            index = json.load(fileObj)
+        self.synMechLabels = index['synMechs']     # synMechs column indexes these
+        self.secLabels = index['secs']             # secs column indexes these
+
+        for name, _ in connColumns + [('offsets', np.int64)]:
+            setattr(self, name, np.load(join(dirName, name + '.npy'), mmap_mode='r'))
+
+    def cellConns(self, gids):
+        ''' Return dictionary of columns (memory-mapped views) of the connections onto gids
+
+            gids is a gid, an xrange of consecutive gids (e.g., a population, no copy) or a list of gids.
+        '''
+        if isinstance(gids, (int, long)):
+            gids = xrange(gids, gids + 1)
+        if isinstance(gids, xrange) and (len(gids) < 2 or gids[1] - gids[0] == 1):
+            select = slice(self.offsets[gids[0]], self.offsets[gids[-1] + 1]) if len(gids) else slice(0, 0)
+        else:
+            select = np.concatenate([np.arange(self.offsets[gid], self.offsets[gid + 1]) for gid in gids] + [np.zeros(0, dtype=np.int64)])
+
+        return dict((name, getattr(self, name)[select]) for name, _ in connColumns)
+
+
+class TraceStore(object):
+    def __init__(self, prefix):
+        ''' Traces of a run, written by saveTraces() (memory-mapped) or streamed (TCModel_Traces, HDF5) '''
+        self.prefix = prefix
+        self.sources = {}       # trace name -> {gid: (array or HDF5 dataset)}
+        self.times = None       # sample times (ms), if saved
+
+        if isdir(prefix + '_traces'):
+            with open(join(prefix + '_traces', 'index.json')) as fileObj:
+                index = json.load(fileObj)
+            self.recordStep = index['recordStep']
+            if index.get('times'):
+                self.times = np.load(join(prefix + '_traces', 't.npy'), mmap_mode='r')
+            for trace in index['traces']:
+                array = np.load(join(prefix + '_traces', trace['file'] + '.npy'), mmap_mode='r')
+                self.sources[trace['name']] = dict((gid, array[row]) for row, gid in enumerate(trace['gids']))
+        else:
+            import h5py
+
+            for fileName in sorted(glob(prefix + '_traces_*.h5')):
+                fileObj = h5py.File(fileName, 'r')
+                self.recordStep = fileObj.attrs['recordStep']
+                if self.times is None and 't' in fileObj:
+                    self.times = fileObj['t'][:]
+                for traceName, group in fileObj.items():
+                    if traceName != 't':
+                        cells = self.sources.setdefault(traceName, {})
+                        for cellKey, dataset in group.items():
+                            cells[int(cellKey.split('_')[-1])] = dataset
+
+    def traceNames(self):
+        return sorted(self.sources.keys())
+
+    def gids(self, traceName):
+        return sorted(self.sources[traceName].keys())
+
+    def trace(self, traceName, gid, timeRange=None):
+        ''' Return samples of one cell in timeRange [t0, t1) (ms), a view for memory-mapped traces
+
+            Samples are selected by the saved sample times, else as taken every recordStep from 0.
+        '''
+        source = self.sources[traceName][gid]
+        if timeRange is None:
+            return source[:]
+
+        if self.times is not None:
+            start, stop = np.searchsorted(self.times, timeRange)
+            return source[int(start):int(max(start, stop))]
+
+        start = max(0, int(np.ceil(timeRange[0]/self.recordStep)))
+        stop = max(start, int(np.ceil(timeRange[1]/self.recordStep)))
+        return source[start:stop]
+
+
+class RunResults(object):
+    def __init__(self, prefix):
+        ''' Results of a run, opened lazily, by simConfig filename (e.g., a batch runDir/TC_output)
+
+            A directory holding exactly one run's stores is also accepted.
+        '''
+        if isdir(prefix) and not prefix.endswith('_spikes'):
+            spikeDirs = glob(join(prefix, '*_spikes'))
+            if len(spikeDirs) != 1:
+                raise Exception, 'EXPECTED ONE RUN IN %s, FOUND %d' % (prefix, len(spikeDirs))
+            prefix = spikeDirs[0][:-len('_spikes')]
+
+        self.prefix = prefix
+        self._stores = {}
+
+    def _store(self, name, loader):
+        if name not in self._stores:
+            self._stores[name] = loader()
+        return self._stores[name]
+
+    @property
+    def spikes(self):
+        ''' SpikeFile of the run (see TCModel_Spikes) '''
+        return self._store('spikes', lambda: SpikeFile(self.prefix + '_spikes'))
+
+    @property
+    def conns(self):
+        ''' ConnStore of the run '''
+        return self._store('conns', lambda: ConnStore(self.prefix + '_conns'))
+
+    @property
+    def params(self):
+        ''' Dictionary of netParams and simConfig (as dictionaries) of the run '''
+        def load():
+            with open(self.prefix + '_params.pkl', 'rb') as fileObj:
+                return pickle.load(fileObj)
+        return self._store('params', load)
+
+    @property
+    def traceStore(self):
+        ''' TraceStore of the run '''
+        return self._store('traces', lambda: TraceStore(self.prefix))
+
+    def popGids(self, pop):
+        ''' Return xrange of the gids of a population '''
+        first, numCells = self.spikes.gidRanges[pop]
+        return xrange(first, first + numCells)
+
+    def traces(self, traceName, gids=None, pop=None, timeRange=None):
+        ''' Return dictionary of gid and samples in timeRange of the recorded cells among gids or pop '''
+        store = self.traceStore
+        if pop is not None:
+            gids = self.popGids(pop)
+        recorded = store.gids(traceName)
+        if gids is None:
+            selected = recorded
+        else:
+            gids = set(gids)
+            selected = [gid for gid in recorded if gid in gids]
+
+        return dict((gid, store.trace(traceName, gid, timeRange)) for gid in selected)
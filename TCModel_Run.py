@@ -12,13 +12,25 @@
 
 
 # Import modules
-from netpyne import specs, sim
-import neuron
+# NOTE: netpyne (and with it NEURON) is imported inside functions and main so that
+#       importing this file, e.g., for its helpers, has no heavy side effects
 import os
 from os.path import join
 import numpy as np
 import random
 from GeneratedSynapseParams import cellsec_comps
+from TCModel_Build import loadMechanisms
+from TCModel_Cache import importCachedCellParams
+from TCModel_Connectivity import getConnectome, instantiateConnectome
+from TCModel_GapJunctions import instantiateGapJunctions
+from TCModel_Inputs import stationaryPoisson, targetPops, instantiateEctopicInput
+from TCModel_Network import mergeSynapses
+from TCModel_Parallel import initMPI, popCellCosts, applyLoadBalance, partitionThreads, reportExchangeInterval, reportRunImbalance
+from TCModel_Rest import getRestingStates, applyRestingStates
+from TCModel_State import stateCacheKey, simulateFromEquilibrium
+from TCModel_Results import saveRunStores
+from TCModel_Spikes import saveRunSpikes
+from TCModel_Traces import startTraceWriter
 from time import time
 
 
@@ -43,53 +55,44 @@ def convertIntListToCompList(list):
 
     return new_list
 
-def stationaryPoisson(nsyn,lambd,tstart,tstop):
-    ''' Generates nsyn stationary possion processes with rate lambda between tstart and tstop'''
-    interval_s = (tstop-tstart)*.001
-    spiketimes = []
-    for i in range(nsyn):
-        spikecount = np.random.poisson(interval_s*lambd)
-        spikevec = np.empty(spikecount)
-        if spikecount==0:
-            spiketimes.append(spikevec)
-        else:
-            spikevec = tstart + (tstop-tstart)*np.random.random(spikecount)
-            spiketimes.append(np.sort(spikevec))
+def importCellRules(netParams, fullParams):
+    ''' Load mechanisms then add a cell rule for every population in fullParams to netParams '''
 
-    return spiketimes
+    # Compile (only changed, used .mod files) and load mechanisms before importing templates
+    loadMechanisms(fullParams)
 
+    # Importing cell parameters from .hoc files (or from cache if templates and mechanisms are unchanged)
+    for labels in fullParams.Y_pop_ids:
+        for label_id in labels:
 
-################################################################################
-### LOAD MAIN PARAMETER SETS
-################################################################################
-
-# Import parameter dictionaries for NETPYNE
-from TCModel_Params import PopulationParams
-
-fullParams = PopulationParams()
+            # NOTE: cellParams[X] is set to the label and not the label_id
+            importCachedCellParams(netParams, fullParams.Y_importParams[label_id])
 
-# Create class NetParams object to store imported parameters
-netParams = specs.NetParams(netParamsDict=fullParams.netParamsDict)
+    return netParams
 
-# Importing cell parameters from .hoc files
-for labels in fullParams.Y_pop_ids:
-    for label_id in labels:
+def buildNetParams(fullParams=None):
+    ''' Return specs.NetParams() object with population, synapse, connectivity and cell rules
 
-        label, conds, cellName, fileName = createImports(fullParams.Y_importParams[label_id])
+        fullParams defaults to the memoized TCModel_Params.getPopulationParams() object
+    '''
+    from netpyne import specs
 
-        # NOTE: cellParams[X] must be the label and not the label_id
-        netParams.cellParams[label] = netParams.importCellParams(label=label,
-                                                                 conds=conds,
-                                                                 cellName=cellName,
-                                                                 fileName=fileName)
+    # Import parameter dictionaries for NETPYNE
+    if fullParams is None:
+        from TCModel_Params import getPopulationParams
+        fullParams = getPopulationParams()
 
+    # Create class NetParams object to store imported parameters
+    netParams = specs.NetParams(netParamsDict=fullParams.netParamsDict)
 
+    return importCellRules(netParams, fullParams)
 
+def addStimulation(netParams, current_injection=True, ectopic_events=True):
+    ''' Add current injection and ectopic axonal spike protocols to netParams
 
-################################################################################
-##### MAIN SIMULATION
-################################################################################
-if __name__ == '__main__':
+        If ectopic_events, ectopic spike targets go to netParams.ectopicTargetParams (replayed
+        by TCModel_Inputs.instantiateEctopicInput()) instead of netParams.stimTargetParams.
+    '''
 
     ####################################
     #                                  #
@@ -99,8 +102,6 @@ if __name__ == '__main__':
     #                                  #
     ####################################
 
-    current_injection = True
-
     if current_injection:
 
         # Stimulating electrode source and target
@@ -141,45 +142,188 @@ if __name__ == '__main__':
     netParams.stimSourceParams['ectopic2'] = {'type': 'NetStim', 'interval' : 1000,  'start' : 0, 'noise': 10} # mean interval of 1 s
     # netParams.stimSourceParams['ectopic3'] = {'type': 'NetStim', 'interval' : 20000,  'start' : 0, 'noise': 0.5}  # mean interval of 20 s (this is bare minimum 0.05 spikes/s)
 
+    ectopicTargetParams = {}
+
     # Superficial pyramids
-    netParams.stimTargetParams['ectopic1->L23_E'] = {'source': 'ectopic1', 'conds': {'cellType': 'PYR', 'yrange' : [  81.6,  587.1]},
-                                                     'sec' : 'comp_69', 'loc' : 0.5,                # axon
-                                                     'weight': 1, 'delay': 0}
+    ectopicTargetParams['ectopic1->L23_E'] = {'source': 'ectopic1', 'conds': {'cellType': 'PYR', 'yrange' : [  81.6,  587.1]},
+                                              'sec' : 'comp_69', 'loc' : 0.5,                # axon
+                                              'synMech' : 'exc', 'weight': 1, 'delay': 0}
     # Infragranular pyramids
-    netParams.stimTargetParams['ectopic2->L5_E'] = {'source': 'ectopic2', 'conds': {'cellType': 'PYR', 'yrange' : [  922.2, 1170.0]},
-                                                    'sec' : 'comp_56', 'loc' : 0.5,                # axon
-                                                    'weight': 1, 'delay': 0}
-    netParams.stimTargetParams['ectopic2->L6_E'] = {'source': 'ectopic2', 'conds': {'cellType': 'PYR', 'yrange' : [  1170.0, 1491.7]},
-                                                    'sec' : 'comp_45', 'loc' : 0.5,                # axon
-                                                    'weight': 1, 'delay': 0}
+    ectopicTargetParams['ectopic2->L5_E'] = {'source': 'ectopic2', 'conds': {'cellType': 'PYR', 'yrange' : [  922.2, 1170.0]},
+                                             'sec' : 'comp_56', 'loc' : 0.5,                # axon
+                                             'synMech' : 'exc', 'weight': 1, 'delay': 0}
+    ectopicTargetParams['ectopic2->L6_E'] = {'source': 'ectopic2', 'conds': {'cellType': 'PYR', 'yrange' : [  1170.0, 1491.7]},
+                                             'sec' : 'comp_45', 'loc' : 0.5,                # axon
+                                             'synMech' : 'exc', 'weight': 1, 'delay': 0}
 
     # Granular cells
-    netParams.stimTargetParams['ectopic2->L4_E'] = {'source': 'ectopic2', 'conds': {'cellType': 'STEL'},
-                                                  'sec' : 'comp_54', 'loc' : 0.5,                # axon
-                                                  'weight': 1, 'delay': 0}
+    ectopicTargetParams['ectopic2->L4_E'] = {'source': 'ectopic2', 'conds': {'cellType': 'STEL'},
+                                             'sec' : 'comp_54', 'loc' : 0.5,                # axon
+                                             'synMech' : 'exc', 'weight': 1, 'delay': 0}
+
+    # Explicit populations, as netpyne matches no 'yrange' cond (and 'yRange' by cell positions)
+    for target in ectopicTargetParams.values():
+        target['conds'] = {'pop' : targetPops(netParams.popParams, target['conds'])}
+
+    # Replay pre-generated trains with one PatternStim per population (TCModel_Inputs) or one NetStim per cell
+    if ectopic_events:
+        netParams.ectopicTargetParams = ectopicTargetParams
+    else:
+        netParams.stimTargetParams.update(ectopicTargetParams)
 
     # # Interneurons aren't firing at al so here's a fix
     # netParams.stimTargetParams['ectopic3->all_I'] = {'source' : 'ectopic3', 'conds' : {'cellType' : ['BASK', 'AXO', 'IN']}
     #                                                   'sec' : 'comp_1', 'loc' : 0.5,
     #                                                   'weight' : 1, 'delay' : 0}
 
+    return netParams
+
+def createNetwork(netParams, simConfig, simConfigs):
+    ''' Same as netpyne sim.create() plus the build options in simConfigs (SimulationConfigs object) '''
+    from netpyne import sim
+
+    # Spikes are exchanged between ranks every minDelay, NEURON's parallel fixed step method needs >= dt
+    if netParams.minDelay < simConfig.dt:
+        raise Exception, 'minDelay (%g ms) BELOW dt (%g ms): INCREASE minDelay OR DECREASE dt' % (netParams.minDelay, simConfig.dt)
+
+    # Estimated cost per cell for load balancing (before chemical pathways leave connParams below)
+    popCosts = popCellCosts(netParams)
+
+    # Generate (or reload) with the vectorized traubCellConn the chemical (nativeConnectivity) and/or
+    # electrical (gapJunctions) pathways not left to netpyne
+    nativeLabels = [label for label, connParam in netParams.connParams.items()
+                    if connParam.get('connFunc') == 'traubCellConn' and
+                    (simConfigs.gapJunctions != 'netpyne' if connParam.get('gapJunction', False) else simConfigs.nativeConnectivity)]
+    connectome = {}     # empty if no pathway is left (e.g., no gap junctions) to the native engines
+    if nativeLabels:
+        connectome = getConnectome(netParams.popParams, netParams.connParams, seed=simConfig.seeds['conn'], labels=nativeLabels)
+        for label in nativeLabels:
+            del netParams.connParams[label]
+
+    sim.initialize(netParams=netParams, simConfig=simConfig)
+    sim.net.createPops()
+
+    # Assign cells to ranks by estimated cost instead of round-robin
+    if simConfigs.loadBalance and sim.nhosts > 1:
+        applyLoadBalance(popCosts)
+
+    sim.net.createCells()
+    sim.net.connectCells()
+
+    if simConfigs.nativeConnectivity:
+        instantiateConnectome(connectome, netParams)
+
+    # Gap junctions with voltage transfer between (possibly different) ranks or implicit coupling
+    if simConfigs.gapJunctions in ['transfer', 'implicit']:
+        instantiateGapJunctions(connectome, netParams, implicit=(simConfigs.gapJunctions == 'implicit'))
+
+    # Share one point process per (cell, section, mechanism) between NetCons of linear synapses
+    if simConfigs.mergeSynapses:
+        mergeSynapses(simConfigs.mergeSynMechs)
+
+    # Start cells from the resting state of their template instead of a random potential
+    if simConfigs.initMode == 'rest':
+        states = getRestingStates(simConfigs.params, dict(simConfig.hParams), simConfig.dt)
+        applyRestingStates(states, simConfigs.restJitter, simConfig.seeds['loc'])
+    elif simConfigs.initMode != 'random':
+        raise Exception, 'UNKNOWN INITIALIZATION MODE %s' % simConfigs.initMode
+
+    sim.net.addStims()
+
+    # Ectopic axonal spikes replayed from pre-generated event arrays
+    if getattr(netParams, 'ectopicTargetParams', None):
+        instantiateEctopicInput(netParams, simConfig.duration, simConfig.seeds['stim'])
+
+    sim.setupRecording()
+
+    # Threads within each process (THREADSAFE mechanisms, LinearMechanism couplings need one thread)
+    if simConfigs.nthreads > 1:
+        if simConfigs.gapJunctions == 'implicit':
+            raise Exception, 'IMPLICIT GAP JUNCTIONS REQUIRE nthreads = 1'
+        partitionThreads(simConfigs.nthreads, popCosts)
+
+    # Minimum delay between cells sets how often MPI ranks exchange spikes
+    reportExchangeInterval()
+
+    return sim
 
+def runNetwork(simConfigs, stateKey=None):
+    ''' Same as netpyne sim.simulate() plus the run options in simConfigs (SimulationConfigs object)
+
+        Starts from the equilibrated state of stateKey (see TCModel_State) if given, streams traces
+        (streamTraces), writes spikes in columnar layout to <filename>_spikes (saveSpikes) and
+        params, connections and traces as separate stores (saveStores, see TCModel_Results).
+    '''
+    from netpyne import sim
+
+    traceWriter = startTraceWriter(simConfigs)
+    if stateKey is not None:
+        simulateFromEquilibrium(stateKey, simConfigs.equilibration)
+    else:
+        sim.simulate()
+    if traceWriter is not None:
+        traceWriter.close()
+
+    if simConfigs.saveSpikes:
+        saveRunSpikes(simConfigs.outputPrefix(sim.cfg.filename) + '_spikes')
+    if simConfigs.saveStores:
+        saveRunStores(simConfigs.outputPrefix(sim.cfg.filename), simConfigs.streamTraces)
+
+    return sim
+
+
+
+
+################################################################################
+##### MAIN SIMULATION
+################################################################################
+if __name__ == '__main__':
+
+    # Use MPI if started by a launcher, e.g., mpiexec -n 4 python TCModel_Run.py
+    initMPI()
+
+    from netpyne import specs, sim
+    from TCModel_Config import ModelConfigs
 
     ####################################
     #                                  #
     #                                  #
-    #             RUN MODEL            #
+    #      LOAD MAIN PARAMETER SETS    #
     #                                  #
     #                                  #
     ####################################
 
-    # Import configuration dictionaries for NETPYNE
-    from TCModel_Config import SimulationConfigs
+    # Network and simulation configurations share one parameter build
+    fullConfigs = ModelConfigs()
+    fullParams = fullConfigs.params
+
+    netParams = buildNetParams(fullParams)
+
+
+    # Stimulation protocols (current injection + ectopic axon spikes)
+    addStimulation(netParams)
 
-    fullConfigs = SimulationConfigs()
+
+
+    ####################################
+    #                                  #
+    #                                  #
+    #             RUN MODEL            #
+    #                                  #
+    #                                  #
+    ####################################
 
     # Creare class SimConfig object to store imported configurations
     simConfig  = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
 
+    # Key of the equilibrated state (before createNetwork() removes native pathways from netParams)
+    stateKey = None
+    if fullConfigs.simConfigs.useStateCache:
+        stateKey = stateCacheKey(netParams, simConfig, fullConfigs.simConfigs)
+
     # Build network and run simulation
-    sim.createSimulateAnalyze(netParams=netParams, simConfig=simConfig)
+    createNetwork(netParams, simConfig, fullConfigs.simConfigs)
+    runNetwork(fullConfigs.simConfigs, stateKey)
+    if sim.nhosts > 1:
+        reportRunImbalance()
+    sim.analyze()
@@ -0,0 +1,159 @@
+'''
+    TCModel_Spikes.py writes spikes of a run as columnar arrays with a population and a
+    time-bin index (SimulationConfigs.saveSpikes) and reads (population, time window) queries
+    from memory-mapped files without loading the rest.
+
+    A spike directory holds:
+        times.npy       spike times (float32, ms), sorted by population then time
+        gids.npy        gids of the spikes (int32)
+        popOffsets.npy  spikes of population i are [popOffsets[i], popOffsets[i + 1])
+        binOffsets.npy  (populations x bins + 1), first spike of population i at or after bin j
+        index.json      populations, their gid ranges, bin width and duration
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import json
+import numpy as np
+import os
+from os.path import join, exists
+
+
+# Width of the bins of the time index (ms)
+binWidth = 100.
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def spikeIndex(times, gids, gidRanges, duration, binWidth=binWidth):
+    ''' Return (order, popOffsets, binOffsets) of spikes for the layout of saveSpikes()
+
+        gidRanges is the ordered dictionary of (first gid, number of cells) per population
+        (see TCModel_Connectivity.popGidRanges()). Spikes of gids outside all ranges are dropped.
+    '''
+    firsts = np.array([first for first, _ in gidRanges.values()], dtype=np.int64)
+    ends = firsts + np.array([num for _, num in gidRanges.values()], dtype=np.int64)
+
+    pops = np.searchsorted(firsts, gids, side='right') - 1
+    valid = (pops >= 0) & (gids < ends[np.maximum(pops, 0)])
+    valid = np.flatnonzero(valid)
+
+    order = valid[np.lexsort((times[valid], pops[valid]))]
+    sortedPops = pops[order]
+    popOffsets = np.searchsorted(sortedPops, np.arange(len(firsts) + 1))
+
+    # First spike of every (population, bin) by one search of (population, bin) keys
+    numBins = max(1, int(np.ceil(duration/binWidth)))
+    bins = np.minimum((times[order]/binWidth).astype(np.int64), numBins)
+    keys = sortedPops*(numBins + 1) + bins
+    queries = np.arange(len(firsts))[:, None]*(numBins + 1) + np.arange(numBins + 1)[None, :]
+    binOffsets = np.searchsorted(keys, queries)
+
+    return order, popOffsets, binOffsets
+
+
+def saveSpikes(dirName, times, gids, gidRanges, duration, binWidth=binWidth):
+    ''' Write spikes (times in ms, gids) in columnar layout with population and time index to dirName '''
+    # Index by the stored (float32) times so queries never miss spikes rounded across a bin edge
+    times = np.asarray(times, dtype=np.float32).astype(np.float64)
+    gids = np.asarray(gids, dtype=np.int64)
+    order, popOffsets, binOffsets = spikeIndex(times, gids, gidRanges, duration, binWidth)
+
+    if not exists(dirName):
+        os.makedirs(dirName)
+
+    np.save(join(dirName, 'times.npy'), times[order].astype(np.float32))
+    np.save(join(dirName, 'gids.npy'), gids[order].astype(np.int32))
+    np.save(join(dirName, 'popOffsets.npy'), popOffsets.astype(np.int64))
+    np.save(join(dirName, 'binOffsets.npy'), binOffsets.astype(np.int64))
+    with open(join(dirName, 'index.json'), 'w') as fileObj:
+        json.dump({'pops' : list(gidRanges.keys()),
+                   'gidRanges' : [list(gidRange) for gidRange in gidRanges.values()],
+                   'binWidth' : binWidth,
+                   'duration' : duration}, fileObj, indent=1)
+
+    return dirName
+
+
+def saveRunSpikes(dirName):
+    ''' Write spikes of the finished run (sim.allSimData, on rank 0) with saveSpikes() '''
+    from netpyne import sim
+    from TCModel_Connectivity import popGidRanges
+
+    if sim.rank == 0:
+        saveSpikes(dirName, np.asarray(sim.allSimData['spkt']), np.asarray(sim.allSimData['spkid']),
+                   popGidRanges(sim.net.params.popParams), sim.cfg.duration)
+
+
+
+################################################################################
+#### Class declarations
+################################################################################
+class SpikeFile(object):
+    def __init__(self, dirName):
+        ''' Memory-mapped spikes written by saveSpikes()
+
+            Example usage:
+            >> spikes = SpikeFile('output/dat/TC_output_spikes')
+            >> times, gids = spikes.spikes('L5_IB_PYR', [200, 400])
+        '''
+        with open(join(dirName, 'index.json')) as fileObj:
+            index = json.load(fileObj)
+
+        self.pops = [str(pop) for pop in index['pops']]
+        self.gidRanges = dict(zip(self.pops, [tuple(gidRange) for gidRange in index['gidRanges']]))
+        self.binWidth = index['binWidth']
+        self.duration = index['duration']
+
+        self.times = np.load(join(dirName, 'times.npy'), mmap_mode='r')
+        self.gids = np.load(join(dirName, 'gids.npy'), mmap_mode='r')
+        self.popOffsets = np.load(join(dirName, 'popOffsets.npy'))
+        self.binOffsets = np.load(join(dirName, 'binOffsets.npy'))
+
+    def searchTime(self, index, t):
+        ''' Return position of the first spike of population index at or after time t
+
+            Only the spikes of the bin of t are searched (read).
+        '''
+        numBins = self.binOffsets.shape[1] - 1
+        timeBin = min(max(int(t//self.binWidth), 0), numBins)
+        start = self.binOffsets[index, timeBin]
+        stop = self.binOffsets[index, timeBin + 1] if timeBin < numBins else self.popOffsets[index + 1]
+
+        return int(start + np.searchsorted(np.asarray(self.times[start:stop]), t))
+
+    def spikeRange(self, pop, timeRange=None):
+        ''' Return (start, stop) of the spikes of pop in timeRange [t0, t1) (ms) '''
+        index = self.pops.index(pop)
+        if timeRange is None:
+            return int(self.popOffsets[index]), int(self.popOffsets[index + 1])
+
+        start = self.searchTime(index, timeRange[0])
+        return start, max(start, self.searchTime(index, timeRange[1]))
+
+    def spikes(self, pop=None, timeRange=None):
+        ''' Return (times, gids) of the spikes of pop (or list of pops, default all) in timeRange [t0, t1)
+
+            Spikes are sorted by population then time. Only the requested spikes are read.
+        '''
+        pops = self.pops if pop is None else [pop] if isinstance(pop, basestring) else pop
+
+        times, gids = [], []
+        for pop in pops:
+            start, stop = self.spikeRange(pop, timeRange)
+            times.append(np.asarray(self.times[start:stop]))
+            gids.append(np.asarray(self.gids[start:stop]))
+
+        return np.concatenate(times), np.concatenate(gids)
+
+    def counts(self, timeRange=None):
+        ''' Return dictionary of number of spikes per population in timeRange '''
+        counts = {}
+        for pop in self.pops:
+            start, stop = self.spikeRange(pop, timeRange)
+            counts[pop] = stop - start
+
+        return counts
@@ -0,0 +1,116 @@
+'''
+    TCModel_State.py saves and restores the equilibrated state of a network so runs can skip
+    the settling period from random initial potentials (SimulationConfigs.equilibration).
+
+    The state (NEURON SaveState: all state variables and the queue of pending events) after
+    the equilibration period is stored in the cache directory, keyed by everything it depends
+    on: netParams, the random seeds, dt and hParams, the build options, the mechanism library
+    and the number of ranks (one file per rank). A run with the same key restores it and only
+    simulates from the end of the equilibration period to the end of the run.
+
+    NOTE: random streams (e.g., NetStim noise) are not part of the state, so runs from a
+    restored state are statistically equivalent to, not identical with, uninterrupted runs.
+    Recorded traces hold the initial sample followed by samples from the equilibration time on.
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import os
+from os.path import exists
+import TCModel_Cache
+
+
+# specs.SimConfig() attributes and build options of SimulationConfigs the equilibrated state depends on
+stateConfigs = ['dt', 'hParams', 'seeds', 'cvode_active', 'cvode_atol', 'cache_efficient']
+stateBuildOptions = ['mergeSynapses', 'mergeSynMechs', 'nativeConnectivity', 'gapJunctions', 'loadBalance', 'nthreads',
+                     'initMode', 'restJitter']
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def stateCacheKey(netParams, simConfig, simConfigs):
+    ''' Return key of the equilibrated state of the network built from netParams, simConfig and simConfigs
+
+        Must be called before TCModel_Run.createNetwork() (which removes natively created pathways
+        from netParams.connParams) and after the mechanisms are loaded.
+    '''
+    from neuron import h
+    import TCModel_Build
+
+    digest = TCModel_Cache.hashFiles([TCModel_Cache.sourceFile(TCModel_Build)])
+    TCModel_Cache.hashObject(dict((key, value) for key, value in netParams.__dict__.items() if not key.startswith('_')), digest)
+    TCModel_Cache.hashObject(dict((name, getattr(simConfig, name, None)) for name in stateConfigs), digest)
+    TCModel_Cache.hashObject(dict((name, getattr(simConfigs, name, None)) for name in stateBuildOptions), digest)
+    TCModel_Cache.hashObject([simConfigs.equilibration, TCModel_Build.mechanismsDir(), int(h.ParallelContext().nhost())], digest)
+
+    return digest.hexdigest()
+
+
+def stateFile(stateKey):
+    ''' Return name of the state file of this rank '''
+    from netpyne import sim
+
+    return TCModel_Cache.cachePath('state', '%s_%d' % (stateKey, sim.rank), '.dat')
+
+
+def saveState(fileName):
+    ''' Write current state of all cells and events of this rank (atomically) '''
+    from neuron import h
+
+    TCModel_Cache.makeCacheDir()
+    tmpName = fileName + '.%d.tmp' % os.getpid()
+
+    savedState = h.SaveState()
+    savedState.save()
+    fileObj = h.File()
+    fileObj.wopen(tmpName)
+    savedState.fwrite(fileObj)
+    fileObj.close()
+    os.rename(tmpName, fileName)
+
+
+def restoreState(fileName):
+    ''' Restore state written by saveState() (model must be initialized, t jumps to the saved time) '''
+    from neuron import h
+
+    savedState = h.SaveState()
+    fileObj = h.File()
+    fileObj.ropen(fileName)
+    savedState.fread(fileObj)
+    fileObj.close()
+    savedState.restore()
+
+
+def simulateFromEquilibrium(stateKey, equilibration):
+    ''' Same as sim.simulate() but starting from the equilibrated state of stateKey (see stateCacheKey())
+
+        If not every rank has the state, the equilibration period is simulated and its end state
+        saved, after which the run continues as usual. Returns True if the state was restored.
+    '''
+    from netpyne import sim
+
+    fileName = stateFile(stateKey)
+    restored = bool(sim.pc.allreduce(int(exists(fileName)), 3))     # 3: minimum over ranks
+
+    sim.preRun()    # initializes the model (h.finitialize)
+    sim.pc.barrier()
+    sim.timing('start', 'runTime')
+
+    if restored:
+        restoreState(fileName)
+    else:
+        sim.pc.psolve(equilibration)
+        saveState(fileName)
+
+    if sim.rank == 0:
+        print '\nRunning from %s state at %.1f ms to %.1f ms...' % ('restored' if restored else 'saved', equilibration, sim.cfg.duration)
+
+    sim.pc.psolve(sim.cfg.duration)
+    sim.pc.barrier()
+    sim.timing('stop', 'runTime')
+    sim.gatherData()
+
+    return restored
@@ -0,0 +1,122 @@
+'''
+    TCModel_Traces.py streams recorded traces (simConfig recordTraces and the time vector) to
+    chunked, compressed HDF5 datasets during the run (SimulationConfigs.streamTraces).
+
+    A periodic CVode event every traceFlushInterval appends the samples recorded since the
+    last flush to the datasets and empties the recording Vectors (which keep recording), so
+    memory for traces is bounded by the flush interval instead of growing with the run.
+    Every rank writes its own file <output prefix>_traces_<rank>.h5 (next to the other stores of
+    the run, see SimulationConfigs.outputPrefix()) with one dataset per trace and
+    cell ('<trace>/cell_<gid>') and the sample times ('t').
+
+    NOTE: traces in sim.allSimData only hold the samples after the last flush, so plotTraces is
+    removed from the run's analysis and analyses of traces should read the HDF5 files (e.g.,
+    TCModel_Results.RunResults). Requires h5py.
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import os
+from os.path import dirname, exists
+
+
+################################################################################
+#### Class declarations
+################################################################################
+class TraceWriter(object):
+    def __init__(self, fileName, interval, compression='gzip'):
+        ''' Stream the traces recorded by netpyne on this rank to fileName every interval (ms)
+
+            Must be created after sim.setupRecording() and before the run is initialized.
+        '''
+        try:
+            import h5py
+        except ImportError:
+            raise Exception, 'STREAMING TRACES REQUIRES h5py'
+        from neuron import h
+        from netpyne import sim
+
+        if dirname(fileName) and not exists(dirname(fileName)):
+            os.makedirs(dirname(fileName))
+
+        self.interval = interval
+        self.fileObj = h5py.File(fileName, 'w')
+        self.fileObj.attrs['recordStep'] = sim.cfg.recordStep
+
+        # One HDF5 chunk per flush interval
+        chunkSize = max(1, int(round(interval/sim.cfg.recordStep)))
+
+        # (dataset, recording Vector) of all recorded traces on this rank
+        self.traces = []
+        if 't' in sim.simData:
+            self.traces.append((self.createDataset('t', chunkSize, compression), sim.simData['t']))
+        for traceName in sim.cfg.recordTraces:
+            for cellKey, vector in sorted(sim.simData.get(traceName, {}).items()):
+                self.traces.append((self.createDataset(traceName + '/' + cellKey, chunkSize, compression), vector))
+
+        self.initHandler = h.FInitializeHandler(self.start)
+
+    def createDataset(self, path, chunkSize, compression):
+        return self.fileObj.create_dataset(path, shape=(0,), maxshape=(None,), chunks=(chunkSize,),
+                                           dtype='f8', compression=compression)
+
+    def start(self):
+        ''' Schedule first flush (called at initialization, which clears the event queue) '''
+        from neuron import h
+
+        h.CVode().event(h.t + self.interval, self.flush)
+
+    def flush(self):
+        ''' Write samples recorded since last flush and schedule the next one '''
+        from neuron import h
+        from netpyne import sim
+
+        self.write()
+        if h.t + self.interval < sim.cfg.duration:
+            h.CVode().event(h.t + self.interval, self.flush)
+
+    def write(self):
+        ''' Append samples of all recording Vectors to their datasets and empty the Vectors '''
+        for dataset, vector in self.traces:
+            numSamples = int(vector.size())
+            if numSamples:
+                numWritten = dataset.shape[0]
+                dataset.resize((numWritten + numSamples,))
+                dataset[numWritten:] = vector.as_numpy()
+                vector.resize(0)
+        self.fileObj.flush()
+
+    def close(self):
+        ''' Write remaining samples (call after the run) and close file '''
+        self.write()
+        self.fileObj.close()
+
+
+
+################################################################################
+#### Function declarations
+################################################################################
+def traceFile(filename, rank):
+    ''' Return name of the trace file of a rank for simConfig filename '''
+    return '%s_traces_%d.h5' % (filename, rank)
+
+
+def startTraceWriter(simConfigs):
+    ''' Return TraceWriter streaming this rank's traces if simConfigs.streamTraces, else None
+
+        Removes plotTraces from the analysis of sim.cfg (it would only plot the last interval).
+    '''
+    from netpyne import sim
+
+    if not simConfigs.streamTraces:
+        return None
+    if simConfigs.useStateCache:
+        raise Exception, 'STREAMING TRACES IS NOT SUPPORTED WITH useStateCache (SaveState restores the event queue)'
+
+    prefix = simConfigs.outputPrefix(sim.cfg.filename)
+    if sim.cfg.analysis.pop('plotTraces', None) is not None and sim.rank == 0:
+        print '\nStreaming traces: plotTraces removed from analysis (plot from %s_traces_*.h5)' % prefix
+
+    return TraceWriter(traceFile(prefix, sim.rank), simConfigs.traceFlushInterval)
@@ -0,0 +1,64 @@
+'''
+    bench_cellImport.py compares cold (hoc interpretation) and warm (cached) import times
+    of the cell rules for all populations in TCModel_Params.
+
+    Each measurement runs in a fresh process since NEURON keeps templates loaded.
+    Usage (from any directory):
+        python benchmarks/bench_cellImport.py [num_repeats]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import os
+from os.path import abspath, dirname
+import subprocess
+import sys
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+
+
+def importAll(useCache):
+    ''' Import every population's cell rule and return elapsed wall time (s) '''
+    from netpyne import specs
+    from TCModel_Params import PopulationParams
+    from TCModel_Build import loadMechanisms
+    from TCModel_Cache import importCachedCellParams
+
+    fullParams = PopulationParams()
+    loadMechanisms(fullParams)
+    netParams = specs.NetParams(netParamsDict=fullParams.netParamsDict)
+
+    start = time()
+    for labels in fullParams.Y_pop_ids:
+        for label_id in labels:
+            importCachedCellParams(netParams, fullParams.Y_importParams[label_id], useCache=useCache)
+
+    return time() - start
+
+
+def timeChild(mode):
+    ''' Run one measurement in a fresh interpreter '''
+    out = subprocess.check_output([sys.executable, abspath(__file__), '--child', mode], cwd=path2root)
+    return float(out.strip().splitlines()[-1])
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        os.chdir(path2root)
+        print importAll(useCache=(sys.argv[2] == 'warm'))
+        sys.exit(0)
+
+    num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    # Prime the cache so that every warm measurement is a hit
+    timeChild('warm')
+
+    for mode in ['cold', 'warm']:
+        times = [timeChild(mode) for _ in range(num_repeats)]
+        print '%s import: best %.3f s, mean %.3f s (%d runs)' % (mode, min(times), sum(times)/len(times), num_repeats)
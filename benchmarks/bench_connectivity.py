@@ -0,0 +1,138 @@
+'''
+    bench_connectivity.py times the 'traubCellConn' pathways in two ways:
+    - generation only (no NEURON objects) at the testing and full scales: the batched NumPy
+      generator (TCModel_Connectivity) against a hand-written per-connection Python loop
+      drawing the same rule. The loop is a lower bound for per-connection rule evaluation,
+      NOT a measurement of netpyne.
+    - with 'netpyne': creation of the chemical connections of the testing-scale network,
+      netpyne's sim.net.connectCells() against generateConnectome() + instantiateConnectome()
+      (nativeConnectivity), each in a fresh process after the cells are created.
+    Usage (from any directory):
+        python benchmarks/bench_connectivity.py [num_repeats] [netpyne]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import json
+import os
+from os.path import abspath, dirname, join
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+os.chdir(path2root)
+
+from TCModel_Params import PopulationParams
+from TCModel_Connectivity import generateConnectome, popGidRanges
+
+
+def loopConnectome(popParams, connParams, seed=1):
+    ''' Reference: draw every connection separately in a hand-written Python loop (not netpyne) '''
+    gidRanges = popGidRanges(popParams)
+    rand = random.Random(seed)
+
+    conns = []
+    for label in sorted(connParams.keys()):
+        connParam = connParams[label]
+        preFirst, numPre = gidRanges[connParam['preConds']['pop']]
+        postFirst, numPost = gidRanges[connParam['postConds']['pop']]
+        for post in range(numPost):
+            for _ in range(int(connParam['numPreToPost'])):
+                pre = rand.randrange(numPre)
+                while pre == post and numPre > 1 and preFirst == postFirst:
+                    pre = rand.randrange(numPre)
+                conns.append((preFirst + pre, postFirst + post, rand.choice(connParam['sec'])))
+
+    return conns
+
+
+def runChild(native, outFile):
+    ''' Create the cells of the testing-scale network and time creation of its chemical connections '''
+    from netpyne import specs, sim
+    from TCModel_Config import ModelConfigs
+    from TCModel_Connectivity import instantiateConnectome
+    from TCModel_Run import buildNetParams
+
+    fullConfigs = ModelConfigs()
+    netParams = buildNetParams(fullConfigs.params)
+    simConfig = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
+    simConfig.analysis = {}
+    simConfig.savePickle = False
+
+    # Chemical pathways only, created by netpyne or natively
+    labels = [label for label, connParam in netParams.connParams.items()
+              if connParam.get('connFunc') == 'traubCellConn' and not connParam.get('gapJunction', False)]
+    connParams = dict((label, netParams.connParams[label]) for label in labels)
+    for label in netParams.connParams.keys():
+        if native or label not in labels:
+            del netParams.connParams[label]
+
+    sim.initialize(netParams=netParams, simConfig=simConfig)
+    sim.net.createPops()
+    sim.net.createCells()
+
+    start = time()
+    if native:
+        instantiateConnectome(generateConnectome(netParams.popParams, connParams, seed=simConfig.seeds['conn']), netParams)
+    else:
+        sim.net.connectCells()
+    t_conn = time() - start
+
+    with open(outFile, 'w') as fileObj:
+        json.dump({'time' : t_conn, 'conns' : sum(len(cell.conns) for cell in sim.net.cells)}, fileObj)
+
+
+def best(func, num_repeats, *args):
+    ''' Return (best wall time (s), result) of num_repeats calls '''
+    times = []
+    for _ in range(num_repeats):
+        start = time()
+        result = func(*args)
+        times.append(time() - start)
+
+    return min(times), result
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 3 and sys.argv[1] == '--child':
+        runChild(sys.argv[2] == 'native', sys.argv[3])
+        sys.exit(0)
+
+    num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    for testing in [True, False]:
+        fullParams = PopulationParams(testing)
+        popParams, connParams = fullParams.Y_populationParams, fullParams.Y_projectParams
+
+        t_numpy, connectome = best(generateConnectome, num_repeats, popParams, connParams)
+        t_loop, conns = best(loopConnectome, num_repeats, popParams, connParams)
+
+        num_conns = sum(len(pathway['preGids']) for pathway in connectome.values())
+        num_cells = sum(popParam['numCells'] for popParam in popParams.values())
+        print '%s scale (%d cells, %d connections):' % ('testing' if testing else 'full', num_cells, num_conns)
+        print '    hand-written loop (not netpyne): %.3f s' % t_loop
+        print '    numpy:                           %.3f s (%.0fx)' % (t_numpy, t_loop/t_numpy)
+
+    if 'netpyne' in sys.argv[1:]:
+        tmpDir = tempfile.mkdtemp()
+        results = {}
+        for mode in ['netpyne', 'native']:
+            outFile = join(tmpDir, mode + '.json')
+            subprocess.check_call([sys.executable, abspath(__file__), '--child', mode, outFile])
+            with open(outFile) as fileObj:
+                results[mode] = json.load(fileObj)
+        shutil.rmtree(tmpDir)
+
+        print 'testing scale, connection creation after createCells() (NEURON objects included):'
+        print '    netpyne connectCells(): %.3f s (%d conns)' % (results['netpyne']['time'], results['netpyne']['conns'])
+        print '    native:                 %.3f s (%d conns, %.1fx)' % (results['native']['time'], results['native']['conns'],
+                                                                      results['netpyne']['time']/results['native']['time'])
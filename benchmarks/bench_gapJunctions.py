@@ -0,0 +1,107 @@
+'''
+    bench_gapJunctions.py compares the explicit (gGapPar with voltage transfer) and implicit
+    (LinearMechanism) gap junction backends of TCModel_GapJunctions.py.
+
+    The testing-scale network is run with each backend at several timesteps, each in a fresh
+    process, with gap junction conductances scaled by g_scale. The explicit backend at the
+    smallest dt is the reference: run time, number of spikes, spike train agreement and the
+    RMS difference of somatic voltages of recorded cells are reported (nan = blow-up).
+    Usage (from any directory):
+        python benchmarks/bench_gapJunctions.py [duration_ms] [g_scale]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import json
+import numpy as np
+import os
+from os.path import abspath, dirname, join
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+
+from bench_synMerge import compareSpikes
+
+
+# Timesteps (ms) compared, the first one is used for the reference run
+dts = [0.025, 0.05, 0.1, 0.25]
+
+# Recorded cells (one per population) and time resolution of recorded traces (ms)
+recordStep = 0.25
+
+
+def runChild(backend, dt, gScale, duration, outFile):
+    ''' Build and run network in this process and save spikes, traces + timings to outFile '''
+    from netpyne import specs, sim
+    from TCModel_Config import ModelConfigs
+    from TCModel_Run import buildNetParams, addStimulation, createNetwork
+
+    fullConfigs = ModelConfigs()
+    fullConfigs.simConfigs.gapJunctions = backend
+
+    netParams = addStimulation(buildNetParams(fullConfigs.params))
+    for synMech in netParams.synMechParams.values():
+        if synMech['mod'] == 'gGapPar':
+            synMech['g'] *= gScale
+
+    simConfig = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
+    simConfig.duration = duration
+    simConfig.dt = dt
+    simConfig.recordStep = recordStep
+    simConfig.recordCells = [(pop, 0) for pop in netParams.popParams]
+    simConfig.recordTraces = {'V_soma' : {'sec' : 'comp_1', 'loc' : 0.5, 'var' : 'v'}}
+    simConfig.analysis = {}
+    simConfig.savePickle = False
+
+    createNetwork(netParams, simConfig, fullConfigs.simConfigs)
+
+    start = time()
+    sim.simulate()
+    t_run = time() - start
+
+    traces = sim.allSimData['V_soma']
+    cells = sorted(traces.keys())
+    np.savez(outFile, spkt=np.array(sim.allSimData['spkt']), spkid=np.array(sim.allSimData['spkid']),
+             traces=np.array([np.array(traces[cell]) for cell in cells]),
+             stats=json.dumps({'run' : t_run}))
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 5 and sys.argv[1] == '--child':
+        os.chdir(path2root)
+        runChild(sys.argv[2], float(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5]), sys.argv[6])
+        sys.exit(0)
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 500.
+    gScale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        reference = None
+        print '%-9s %6s %8s %7s %12s %12s' % ('backend', 'dt', 'run (s)', 'spikes', 'spikes match', 'V RMS (mV)')
+        for backend in ['transfer', 'implicit']:
+            for dt in dts:
+                outFile = join(tmpDir, '%s_%g.npz' % (backend, dt))
+                subprocess.check_call([sys.executable, abspath(__file__), '--child', backend, str(dt), str(gScale),
+                                       str(duration), outFile], cwd=path2root)
+                result = dict(np.load(outFile))
+                stats = json.loads(str(result['stats']))
+
+                if reference is None:
+                    reference = result
+                n_ref, n, max_diff, match = compareSpikes(reference, result, tol=dt)
+                match = 'no' if max_diff is None else '%s %.3g ms' % ('yes' if match else 'no', max_diff)
+                rms = np.sqrt(np.mean((result['traces'] - reference['traces'])**2))
+
+                print '%-9s %6g %8.2f %7d %12s %12.3g' % (backend, dt, stats['run'], n, match, rms)
+    finally:
+        shutil.rmtree(tmpDir)
@@ -0,0 +1,100 @@
+'''
+    bench_minDelay.py measures the effect of the minimum axonal delay (GeneralParams.minDelay)
+    on MPI scaling.
+
+    The minimum NetCon delay between cells is the interval at which ranks exchange spikes.
+    For every minDelay the network is run on 1 rank and with mpiexec -n N, reporting the
+    resulting exchange interval, run times and the speedup of N ranks over one.
+    Usage (from any directory):
+        python benchmarks/bench_minDelay.py [num_ranks] [duration_ms] [full]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import json
+import os
+from os.path import abspath, dirname, join
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+
+
+# Minimum delays (ms) compared, all runs use the smallest as dt (NEURON requires minDelay >= dt in parallel)
+minDelays = [0.025, 0.1, 0.5, 1.0]
+
+
+def runChild(minDelay, duration, testing, outFile):
+    ''' Build and run network with minDelay on every rank of this MPI job, rank 0 saves timings to outFile '''
+    from TCModel_Parallel import initMPI
+    initMPI()
+
+    from netpyne import specs, sim
+    from TCModel_Config import ModelConfigs
+    from TCModel_Run import buildNetParams, addStimulation, createNetwork
+
+    fullConfigs = ModelConfigs(testing=testing)
+    params = fullConfigs.params
+    params.minDelay = minDelay
+
+    netParams = addStimulation(buildNetParams(params))
+    netParams.minDelay = minDelay
+    for connParam in netParams.connParams.values():
+        if not connParam.get('gapJunction', False):
+            connParam['delay'] = params.connDelay()
+
+    simConfig = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
+    simConfig.duration = duration
+    simConfig.dt = min(minDelays)
+    simConfig.analysis = {}
+    simConfig.savePickle = False
+
+    createNetwork(netParams, simConfig, fullConfigs.simConfigs)
+    interval = sim.pc.set_maxstep(10)
+
+    start = time()
+    sim.simulate()
+    t_run = time() - start
+
+    if sim.rank == 0:
+        with open(outFile, 'w') as fileObj:
+            json.dump({'interval' : interval, 'run' : t_run}, fileObj)
+
+    sim.pc.barrier()
+    sim.pc.done()
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 4 and sys.argv[1] == '--child':
+        os.chdir(path2root)
+        runChild(float(sys.argv[2]), float(sys.argv[3]), sys.argv[4] == 'testing', sys.argv[5])
+        sys.exit(0)
+
+    num_ranks = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 200.
+    scale = 'full' if len(sys.argv) > 3 and sys.argv[3] == 'full' else 'testing'
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        print '%-12s %13s %11s %11s %8s' % ('minDelay(ms)', 'interval(ms)', 'run 1 (s)', 'run %d (s)' % num_ranks, 'speedup')
+        for minDelay in minDelays:
+            stats = {}
+            for n in [1, num_ranks]:
+                outFile = join(tmpDir, '%g_%d.json' % (minDelay, n))
+                subprocess.check_call(['mpiexec', '-n', str(n), sys.executable, abspath(__file__),
+                                       '--child', str(minDelay), str(duration), scale, outFile], cwd=path2root)
+                with open(outFile) as fileObj:
+                    stats[n] = json.load(fileObj)
+
+            print '%-12g %13.3f %11.2f %11.2f %8.2f' % (minDelay, stats[num_ranks]['interval'], stats[1]['run'],
+                        stats[num_ranks]['run'], stats[1]['run']/stats[num_ranks]['run'])
+    finally:
+        shutil.rmtree(tmpDir)
@@ -0,0 +1,100 @@
+'''
+    bench_mpiScaling.py measures strong scaling of the MPI run mode (TCModel_Parallel.py).
+
+    The network with the standard stimulation protocols is built and run with
+    mpiexec -n k for k = 1, 2, 4, ... up to the given number of ranks, with and without
+    cost-weighted load balancing. Build and run times, speedup and parallel efficiency
+    relative to one rank are reported.
+    Usage (from any directory):
+        python benchmarks/bench_mpiScaling.py [max_ranks] [duration_ms] [full]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import json
+import os
+from os.path import abspath, dirname, join
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+
+
+def runChild(loadBalance, duration, testing, outFile):
+    ''' Build and run network on every rank of this MPI job, rank 0 saves timings to outFile '''
+    from TCModel_Parallel import initMPI
+    initMPI()
+
+    from netpyne import specs, sim
+    from TCModel_Config import ModelConfigs
+    from TCModel_Run import buildNetParams, addStimulation, createNetwork
+
+    fullConfigs = ModelConfigs(testing=testing)
+    fullConfigs.simConfigs.loadBalance = loadBalance
+
+    netParams = addStimulation(buildNetParams(fullConfigs.params))
+    simConfig = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
+    simConfig.duration = duration
+    simConfig.analysis = {}
+    simConfig.savePickle = False
+
+    start = time()
+    createNetwork(netParams, simConfig, fullConfigs.simConfigs)
+    sim.pc.barrier()
+    t_build = time() - start
+
+    start = time()
+    sim.simulate()
+    t_run = time() - start
+
+    stepTimes = sim.pc.py_allgather(sim.pc.step_time())
+    if sim.rank == 0:
+        with open(outFile, 'w') as fileObj:
+            json.dump({'build' : t_build, 'run' : t_run, 'stepTimes' : stepTimes}, fileObj)
+
+    sim.pc.barrier()
+    sim.pc.done()
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 4 and sys.argv[1] == '--child':
+        os.chdir(path2root)
+        runChild(sys.argv[2] == 'balanced', float(sys.argv[3]), sys.argv[4] == 'testing', sys.argv[5])
+        sys.exit(0)
+
+    max_ranks = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 200.
+    scale = 'full' if len(sys.argv) > 3 and sys.argv[3] == 'full' else 'testing'
+
+    nranks = [1]
+    while 2*nranks[-1] <= max_ranks:
+        nranks.append(2*nranks[-1])
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        print '%-10s %5s %9s %9s %8s %10s %10s' % ('mode', 'ranks', 'build (s)', 'run (s)', 'speedup', 'efficiency', 'max/mean')
+        for mode in ['roundrobin', 'balanced']:
+            t_ref = None
+            for n in nranks:
+                outFile = join(tmpDir, '%s_%d.json' % (mode, n))
+                subprocess.check_call(['mpiexec', '-n', str(n), sys.executable, abspath(__file__),
+                                       '--child', mode, str(duration), scale, outFile], cwd=path2root)
+                with open(outFile) as fileObj:
+                    stats = json.load(fileObj)
+
+                if t_ref is None:
+                    t_ref = stats['run']
+                stepTimes = stats['stepTimes']
+                imbalance = max(stepTimes)/(sum(stepTimes)/len(stepTimes)) if sum(stepTimes) > 0 else 1.
+                print '%-10s %5d %9.2f %9.2f %8.2f %10.2f %10.3f' % (mode, n, stats['build'], stats['run'],
+                            t_ref/stats['run'], t_ref/stats['run']/n, imbalance)
+    finally:
+        shutil.rmtree(tmpDir)
@@ -0,0 +1,73 @@
+'''
+    bench_poisson.py times generation of background Poisson trains: the batched generator of
+    TCModel_Inputs (stationary and time-varying by thinning) against the former per-train
+    loop with one np.random.poisson call and one sort per train. Mean rates of the generated
+    trains are reported as a check.
+    Usage (from any directory):
+        python benchmarks/bench_poisson.py [num_trains] [rate_Hz] [duration_ms]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import numpy as np
+from os.path import abspath, dirname
+import sys
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+
+from TCModel_Inputs import populationTrains
+
+
+def loopPoisson(nsyn, lambd, tstart, tstop):
+    ''' Reference: former TCModel_Run.stationaryPoisson() (one draw and sort per train) '''
+    interval_s = (tstop-tstart)*.001
+    spiketimes = []
+    for i in range(nsyn):
+        spikecount = np.random.poisson(interval_s*lambd)
+        spikevec = np.empty(spikecount)
+        if spikecount==0:
+            spiketimes.append(spikevec)
+        else:
+            spikevec = tstart + (tstop-tstart)*np.random.random(spikecount)
+            spiketimes.append(np.sort(spikevec))
+
+    return spiketimes
+
+
+def timeit(func, repeats=5):
+    ''' Return best time (s) of repeats calls and the result of the last one '''
+    best = np.inf
+    for _ in range(repeats):
+        start = time()
+        result = func()
+        best = min(best, time() - start)
+
+    return best, result
+
+
+
+if __name__ == '__main__':
+
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 10.
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 1000.
+
+    t_loop, trains = timeit(lambda: loopPoisson(num, rate, 0., duration))
+    loopRate = sum(len(train) for train in trains)/(num*duration*1e-3)
+
+    t_flat, (times, offsets) = timeit(lambda: populationTrains('bench', num, rate, 0., duration))
+    flatRate = len(times)/(num*duration*1e-3)
+
+    modulated = lambda t, i: rate*(1 + np.sin(2*np.pi*t/100.))
+    t_thin, (times, offsets) = timeit(lambda: populationTrains('bench', num, 2*rate, 0., duration, rateFunc=modulated))
+    thinRate = len(times)/(num*duration*1e-3)
+
+    print '\n%d trains at %g Hz over %g ms\n' % (num, rate, duration)
+    print '%-24s %10s %10s %9s' % ('generator', 'time (ms)', 'rate (Hz)', 'speedup')
+    print '%-24s %10.2f %10.2f %9.1f' % ('loop (stationaryPoisson)', 1e3*t_loop, loopRate, 1.)
+    print '%-24s %10.2f %10.2f %9.1f' % ('batched stationary', 1e3*t_flat, flatRate, t_loop/t_flat)
+    print '%-24s %10.2f %10.2f %9.1f' % ('batched thinned', 1e3*t_thin, thinRate, t_loop/t_thin)
@@ -0,0 +1,88 @@
+'''
+    bench_spikes.py times reading the spikes of one population in a time window: unpickling
+    a netpyne-like output (spikes next to params and network data) against a query of the
+    memory-mapped columnar spike files of TCModel_Spikes. Synthetic spikes are used, with the
+    population sizes of the full-scale network and extra payload standing in for the network.
+    Usage (from any directory):
+        python benchmarks/bench_spikes.py [rate_Hz] [duration_ms] [payload_MB]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import cPickle as pickle
+import numpy as np
+from os.path import abspath, dirname, join
+import shutil
+import sys
+import tempfile
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+
+from TCModel_Params import PopulationParams
+from TCModel_Connectivity import popGidRanges
+from TCModel_Spikes import saveSpikes, SpikeFile
+
+
+def timeit(func, repeats=5):
+    ''' Return best time (s) of repeats calls and the result of the last one '''
+    best = np.inf
+    for _ in range(repeats):
+        start = time()
+        result = func()
+        best = min(best, time() - start)
+
+    return best, result
+
+
+def pickleQuery(fileName, first, numCells, timeRange):
+    ''' Reference: unpickle everything, then select the spikes '''
+    with open(fileName, 'rb') as fileObj:
+        data = pickle.load(fileObj)
+    spkt, spkid = np.asarray(data['simData']['spkt']), np.asarray(data['simData']['spkid'])
+    select = (spkid >= first) & (spkid < first + numCells) & (spkt >= timeRange[0]) & (spkt < timeRange[1])
+
+    return spkt[select], spkid[select]
+
+
+
+if __name__ == '__main__':
+
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 5.
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10000.
+    payload = float(sys.argv[3]) if len(sys.argv) > 3 else 100.
+
+    gidRanges = popGidRanges(PopulationParams(False).Y_populationParams)
+    numCells = sum(num for _, num in gidRanges.values())
+    numSpikes = int(rate*numCells*duration*1e-3)
+
+    rng = np.random.RandomState(1)
+    spkt = np.sort(rng.uniform(0, duration, numSpikes))
+    spkid = rng.randint(0, numCells, numSpikes)
+
+    tmpDir = tempfile.mkdtemp()
+    pickleFile = join(tmpDir, 'output.pkl')
+    with open(pickleFile, 'wb') as fileObj:
+        pickle.dump({'simData' : {'spkt' : spkt.tolist(), 'spkid' : spkid.tolist()},
+                     'net' : rng.random_sample(int(payload*1e6/8))}, fileObj, pickle.HIGHEST_PROTOCOL)
+    spikeDir = saveSpikes(join(tmpDir, 'output_spikes'), spkt, spkid, gidRanges, duration)
+
+    pop = gidRanges.keys()[-1]
+    first, num = gidRanges[pop]
+    timeRange = [duration/2, duration/2 + 200.]
+
+    t_pickle, (times, _) = timeit(lambda: pickleQuery(pickleFile, first, num, timeRange), repeats=3)
+    t_open, spikeFile = timeit(lambda: SpikeFile(spikeDir))
+    t_query, (mmapTimes, _) = timeit(lambda: spikeFile.spikes(pop, timeRange))
+
+    print '\n%d spikes of %d cells, %s in [%g, %g) ms: %d spikes\n' % (numSpikes, numCells, pop, timeRange[0], timeRange[1], len(times))
+    print '%-22s %12s' % ('reader', 'time (ms)')
+    print '%-22s %12.2f' % ('pickle', 1e3*t_pickle)
+    print '%-22s %12.2f' % ('columnar open', 1e3*t_open)
+    print '%-22s %12.3f' % ('columnar query', 1e3*t_query)
+    print '\nSame spikes: %s' % (len(times) == len(mmapTimes))
+
+    shutil.rmtree(tmpDir)
@@ -0,0 +1,75 @@
+'''
+    bench_startup.py measures construction time of the network and simulation configurations
+    at full scale (testing=False, 3,360 cells).
+
+    'inherited' repeats what TCModel_Run.py did when SimulationConfigs inherited from
+    PopulationParams (one build for netParams, a second for simConfig), 'composed' builds
+    ModelConfigs which shares one memoized build. The on-disk cache is disabled so that only
+    construction is timed; 'composed+cache' shows a warm start with the cache enabled.
+    Usage (from any directory):
+        python benchmarks/bench_startup.py [num_repeats]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import os
+from os.path import abspath, dirname
+import sys
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+os.chdir(path2root)
+
+import TCModel_Params
+from TCModel_Params import PopulationParams
+from TCModel_Config import ModelConfigs, SimulationConfigs
+
+
+def inherited():
+    ''' Two independent parameter builds as with the former class hierarchy '''
+    fullParams = PopulationParams(testing=False, useCache=False)
+    fullConfigs = SimulationConfigs(PopulationParams(testing=False, useCache=False))
+
+    return fullParams.netParamsDict, fullConfigs.simConfigDict
+
+
+def composed(useCache=False):
+    ''' One shared parameter build '''
+    TCModel_Params._populationParams.clear()    # forget builds of previous repeats
+
+    params = PopulationParams(testing=False, useCache=useCache)
+    TCModel_Params._populationParams[False] = params
+    fullConfigs = ModelConfigs(testing=False)
+
+    return fullConfigs.netParamsDict, fullConfigs.simConfigDict
+
+
+def best(func, num_repeats, *args):
+    ''' Return best wall time (s) of num_repeats calls '''
+    times = []
+    for _ in range(num_repeats):
+        start = time()
+        func(*args)
+        times.append(time() - start)
+
+    return min(times)
+
+
+
+if __name__ == '__main__':
+
+    num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    # Prime on-disk cache for the warm measurement
+    PopulationParams(testing=False)
+
+    t_inherited = best(inherited, num_repeats)
+    t_composed = best(composed, num_repeats)
+    t_cached = best(composed, num_repeats, True)
+
+    print 'inherited:      %.4f s' % t_inherited
+    print 'composed:       %.4f s (%.1f%% saved)' % (t_composed, 100*(1 - t_composed/t_inherited))
+    print 'composed+cache: %.4f s (%.1f%% saved)' % (t_cached, 100*(1 - t_cached/t_inherited))
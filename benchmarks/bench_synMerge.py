@@ -0,0 +1,99 @@
+'''
+    bench_synMerge.py validates and times synapse merging (SimulationConfigs.mergeSynapses).
+
+    The testing-scale network with the standard stimulation protocols is run once unmerged
+    and once merged, each in a fresh process. Point process counts, build and run times
+    are reported and the spike times of both runs are compared.
+    Usage (from any directory):
+        python benchmarks/bench_synMerge.py [duration_ms]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import json
+import numpy as np
+import os
+from os.path import abspath, dirname, join
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+
+
+def runChild(merge, duration, outFile):
+    ''' Build and run network in this process and save spikes + timings to outFile '''
+    from netpyne import specs, sim
+    from TCModel_Config import ModelConfigs
+    from TCModel_Network import countSynMechs
+    from TCModel_Run import buildNetParams, addStimulation, createNetwork
+
+    fullConfigs = ModelConfigs()
+    fullConfigs.simConfigs.mergeSynapses = merge
+
+    netParams = addStimulation(buildNetParams(fullConfigs.params))
+    simConfig = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
+    simConfig.duration = duration
+    simConfig.analysis = {}
+    simConfig.savePickle = False
+
+    start = time()
+    createNetwork(netParams, simConfig, fullConfigs.simConfigs)
+    t_build = time() - start
+
+    start = time()
+    sim.simulate()
+    t_run = time() - start
+
+    np.savez(outFile, spkt=np.array(sim.allSimData['spkt']), spkid=np.array(sim.allSimData['spkid']),
+             stats=json.dumps({'build' : t_build, 'run' : t_run, 'synMechs' : countSynMechs()}))
+
+
+def compareSpikes(a, b, tol=1e-6):
+    ''' Return (number of spikes a, number of spikes b, max abs time difference, match)
+
+        The time difference is None if the cells spike different numbers of times. Trains
+        match if every spike of a has its counterpart in b within tol (ms).
+    '''
+    order_a = np.lexsort((a['spkt'], a['spkid']))
+    order_b = np.lexsort((b['spkt'], b['spkid']))
+
+    if len(order_a) != len(order_b) or np.any(a['spkid'][order_a] != b['spkid'][order_b]):
+        return len(order_a), len(order_b), None, False
+
+    max_diff = np.max(np.abs(a['spkt'][order_a] - b['spkt'][order_b])) if len(order_a) else 0.
+    return len(order_a), len(order_b), max_diff, max_diff <= tol
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 3 and sys.argv[1] == '--child':
+        os.chdir(path2root)
+        runChild(sys.argv[2] == 'merged', float(sys.argv[3]), sys.argv[4])
+        sys.exit(0)
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 500.
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        results = {}
+        for mode in ['unmerged', 'merged']:
+            outFile = join(tmpDir, mode + '.npz')
+            subprocess.check_call([sys.executable, abspath(__file__), '--child', mode, str(duration), outFile], cwd=path2root)
+            results[mode] = dict(np.load(outFile))
+            stats = json.loads(str(results[mode]['stats']))
+            print '%-9s: %7d point processes, build %.2f s, run %.2f s' % (mode, stats['synMechs'], stats['build'], stats['run'])
+
+        n_a, n_b, max_diff, match = compareSpikes(results['unmerged'], results['merged'])
+        if max_diff is None:
+            print 'Spike trains DIFFER: %d (unmerged) vs %d (merged) spikes' % (n_a, n_b)
+        else:
+            print 'Spike trains %s: %d spikes, max time difference %.3g ms' % ('match' if match else 'DIFFER', n_a, max_diff)
+    finally:
+        shutil.rmtree(tmpDir)
@@ -0,0 +1,91 @@
+'''
+    bench_threads.py measures thread scaling on one node (SimulationConfigs.nthreads).
+
+    The network with the standard stimulation protocols is run with 1, 2, 4, ... threads
+    (up to the number of cores), each in a fresh process. Run times, speedup, parallel
+    efficiency and agreement of the spike trains with the single thread run are reported.
+    Usage (from any directory):
+        python benchmarks/bench_threads.py [max_threads] [duration_ms] [full]
+
+    Contributors: Vergil R. Haynes, vrhaynes.tech@gmail.com
+
+'''
+
+# Import modules
+import json
+import multiprocessing
+import numpy as np
+import os
+from os.path import abspath, dirname, join
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+path2root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, path2root)
+
+from bench_synMerge import compareSpikes
+
+
+def runChild(nthreads, duration, testing, outFile):
+    ''' Build and run network with nthreads threads in this process and save spikes + timings to outFile '''
+    from netpyne import specs, sim
+    from TCModel_Config import ModelConfigs
+    from TCModel_Run import buildNetParams, addStimulation, createNetwork
+
+    fullConfigs = ModelConfigs(testing=testing)
+    fullConfigs.simConfigs.nthreads = nthreads
+
+    netParams = addStimulation(buildNetParams(fullConfigs.params))
+    simConfig = specs.SimConfig(simConfigDict=fullConfigs.simConfigDict)
+    simConfig.duration = duration
+    simConfig.analysis = {}
+    simConfig.savePickle = False
+
+    createNetwork(netParams, simConfig, fullConfigs.simConfigs)
+
+    start = time()
+    sim.simulate()
+    t_run = time() - start
+
+    np.savez(outFile, spkt=np.array(sim.allSimData['spkt']), spkid=np.array(sim.allSimData['spkid']),
+             stats=json.dumps({'run' : t_run}))
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 4 and sys.argv[1] == '--child':
+        os.chdir(path2root)
+        runChild(int(sys.argv[2]), float(sys.argv[3]), sys.argv[4] == 'testing', sys.argv[5])
+        sys.exit(0)
+
+    max_threads = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 500.
+    scale = 'full' if len(sys.argv) > 3 and sys.argv[3] == 'full' else 'testing'
+
+    nthreads = [1]
+    while 2*nthreads[-1] <= max_threads:
+        nthreads.append(2*nthreads[-1])
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        reference = None
+        print '%7s %8s %8s %10s %12s' % ('threads', 'run (s)', 'speedup', 'efficiency', 'spikes match')
+        for n in nthreads:
+            outFile = join(tmpDir, '%d.npz' % n)
+            subprocess.check_call([sys.executable, abspath(__file__), '--child', str(n), str(duration), scale, outFile],
+                                  cwd=path2root)
+            result = dict(np.load(outFile))
+            stats = json.loads(str(result['stats']))
+
+            if reference is None:
+                reference, t_ref = result, stats['run']
+            _, _, max_diff, match = compareSpikes(reference, result)
+            match = 'no' if max_diff is None else '%s %.3g ms' % ('yes' if match else 'no', max_diff)
+
+            print '%7d %8.2f %8.2f %10.2f %12s' % (n, stats['run'], t_ref/stats['run'], t_ref/stats['run']/n, match)
+    finally:
+        shutil.rmtree(tmpDir)
@@ -47,6 +47,7 @@ ENDCOMMENT
 
 NEURON {
 	POINT_PROCESS AMPA  : since only used for ampa, a preferable name to AlphaSynDiffEqT
+	THREADSAFE
 	RANGE tau, e, i : tau1 removed from RANGE because under program cntrl
 			: what was tau2 was renamed tau for easy remembering
 			: during use of this synapse
@@ -36,8 +36,9 @@ UNITS {
     
 NEURON {
     POINT_PROCESS Syn_AMPA_L4SS_L4SS
+    THREADSAFE
     RANGE tau_rise, tau_decay 
-    GLOBAL total
+    RANGE total
     
 
 
@@ -36,8 +36,9 @@ UNITS {
     
 NEURON {
     POINT_PROCESS Syn_AMPA_L4SS_Pyr
+    THREADSAFE
     RANGE tau_rise, tau_decay 
-    GLOBAL total
+    RANGE total
     
 
 
@@ -36,6 +36,7 @@ UNITS {
     
 NEURON {
     POINT_PROCESS Syn_Elect_SupPyr_SupPyr
+    THREADSAFE
     NONSPECIFIC_CURRENT i
     RANGE g, i
     RANGE weight
@@ -36,12 +36,12 @@ UNITS {
     
 NEURON {
     POINT_PROCESS Syn_NMDA_L4SS_IN
+    THREADSAFE
     RANGE tau_rise, tau_decay 
-    GLOBAL total
+    RANGE total
     
 
     RANGE mg_conc, eta, gamma, gblock
-    GLOBAL total
 
 
     RANGE i, e, gmax
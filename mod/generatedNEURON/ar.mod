@@ -39,6 +39,7 @@ NEURON {
       
 
     SUFFIX ar
+    THREADSAFE
     USEION ar READ ear WRITE iar VALENCE 1  ? reversal potential of ion is read, outgoing current is written
            
         
@@ -39,6 +39,7 @@ UNITS {
     
 NEURON {
     SUFFIX cad
+    THREADSAFE
     USEION ca READ ica WRITE cai VALENCE 2
     
     RANGE cai
@@ -39,6 +39,7 @@ NEURON {
       
 
     SUFFIX cal
+    THREADSAFE
     USEION ca WRITE ica VALENCE 2 ?  outgoing current is written
            
         
@@ -39,6 +39,7 @@ NEURON {
       
 
     SUFFIX cat
+    THREADSAFE
     USEION cat READ ecat WRITE icat VALENCE 1  ? reversal potential of ion is read, outgoing current is written
            
         
@@ -39,6 +39,7 @@ NEURON {
       
 
     SUFFIX cat_a
+    THREADSAFE
     USEION cat_a READ ecat_a WRITE icat_a VALENCE 1  ? reversal potential of ion is read, outgoing current is written
            
         
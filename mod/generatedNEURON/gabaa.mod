@@ -1,5 +1,6 @@
 NEURON {
 	POINT_PROCESS GABAA
+	THREADSAFE
 	RANGE tau, e, i
 	NONSPECIFIC_CURRENT i
 	GLOBAL gfac
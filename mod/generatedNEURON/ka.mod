@@ -39,6 +39,7 @@ NEURON {
       
 
     SUFFIX ka
+    THREADSAFE
     USEION k READ ek WRITE ik VALENCE 1  ? reversal potential of ion is read, outgoing current is written
            
         
@@ -39,6 +39,7 @@ NEURON {
       
 
     SUFFIX napf_spinstell
+    THREADSAFE
     USEION na READ ena WRITE ina VALENCE 1  ? reversal potential of ion is read, outgoing current is written
            
         
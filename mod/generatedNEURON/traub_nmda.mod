@@ -9,6 +9,7 @@ Tom Morse, Michael Hines
 ENDCOMMENT
 NEURON {
 	POINT_PROCESS NMDA
+	THREADSAFE
 	RANGE tau, time_interval, e, i,weight, NMDA_saturation_fact, flag, g
 	NONSPECIFIC_CURRENT i
 	GLOBAL gfac
@@ -36,9 +37,6 @@ PARAMETER {
 		: the conductance scale, weight, for testing against the
 		: instantaneous conductance, to see if it should be limited.
 : FORTRAN nmda subroutine constants and variables here end with underbar 
-	A_ = 0 (1) : initialized with below in INITIAL, assigned in each integrate_celltype.f
-	BB1_ = 0 (1) : assigned in each integrate_celltype.f
-	BB2_ = 0 (1) : assigned in each integrate_celltype.f
 	Mg = 1.5 (mM) : a FORTRAN variable set in groucho.f
 	gfac = 1
 }
@@ -46,6 +44,9 @@ PARAMETER {
 ASSIGNED {
 	v (mV)
 	i (nA)
+	A_ (1) : initialized with below in INITIAL, assigned in each integrate_celltype.f
+	BB1_ (1) : assigned in each integrate_celltype.f
+	BB2_ (1) : assigned in each integrate_celltype.f
 	event_count (1)	: counts number of syn events being processed
 	k (uS/ms) : slope of ramp or 0
 	g (uS)
@@ -4,6 +4,7 @@
 : set g=0 which of course is infinite resistance.
 NEURON {
 	POINT_PROCESS gGapPar
+	THREADSAFE
 	RANGE g, i, vpeer
 	RANGE weight
 	ELECTRODE_CURRENT i